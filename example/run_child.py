@@ -2,22 +2,19 @@
 import logging
 
 import fire
-import gokart
 import luigi
-from gokart.target import make_target
+
+from kannon.child import run_task_on_bullet
 
 logging.basicConfig(level=logging.INFO)
 
 
-def main(task_pkl_path: str) -> None:
+def main(task_pkl_path: str, remote_config_path: str = "") -> None:
     # Load luigi config
     luigi.configuration.LuigiConfigParser.add_config_path("./conf/base.ini")
 
-    # Parse a serialized gokart.TaskOnKart
-    task: gokart.TaskOnKart = make_target(task_pkl_path).load()
-
-    # Run gokart.build
-    gokart.build(task)
+    # Load a pickled gokart.TaskOnKart and run gokart.build
+    run_task_on_bullet(task_pkl_path, remote_config_path or None)
 
 
 if __name__ == "__main__":
@@ -1,2 +1,4 @@
+from kannon.async_master import AsyncKannon
+from kannon.executor import BulletExecutor, LocalProcessExecutor
 from kannon.master import Kannon
 from kannon.task import TaskOnBullet
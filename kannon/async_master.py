@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, Callable, Sequence, TypeVar
+
+import gokart
+import luigi
+from luigi.task import flatten
+
+from .master import Kannon
+from .task import TaskOnBullet
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncKannon(Kannon):
+    """Kannon which drives scheduling on asyncio.
+
+    Each task is scheduled by its own coroutine which waits for its dependencies, so that a slow task never blocks checks of the others.
+    Blocking calls such as Kubernetes API calls, `complete()` checks and pickle dumps are offloaded to a thread pool of `max_concurrent_calls` threads.
+    Tasks on master job are still executed one by one, while child jobs are watched in background.
+    """
+
+    def __init__(self, *args: Any, poll_interval_sec: float = 1.0, max_concurrent_calls: int = 32, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        if poll_interval_sec <= 0:
+            raise ValueError(f"poll_interval_sec must be positive, but got {poll_interval_sec}")
+        if max_concurrent_calls <= 0:
+            raise ValueError(f"max_concurrent_calls must be positive integer, but got {max_concurrent_calls}")
+        self.poll_interval_sec = poll_interval_sec
+        self.max_concurrent_calls = max_concurrent_calls
+
+        self.task_id_to_future: dict[str, asyncio.Task[None]] = dict()
+
+    def build(self, root_task: gokart.TaskOnKart | Sequence[gokart.TaskOnKart]) -> None:
+        asyncio.run(self.build_async(root_task))
+
+    async def build_async(self, root_task: gokart.TaskOnKart | Sequence[gokart.TaskOnKart]) -> None:
+        """Build given root tasks and their dependencies on the running event loop."""
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.max_concurrent_calls, thread_name_prefix="kannon")
+        self._master_task_lock = asyncio.Lock()
+        self._child_job_semaphore = asyncio.Semaphore(self.max_child_jobs) if self.max_child_jobs is not None else None
+        self.task_id_to_future = dict()
+        # luigi worker installs a signal handler by default, which is available only on the main thread.
+        # newer gokart has its own worker config section.
+        config = luigi.configuration.get_config()
+        overridden_sections = []
+        for section in ["worker", "gokart_worker"]:
+            if not config.has_option(section, "no_install_shutdown_handler"):
+                if not config.has_section(section):
+                    config.add_section(section)
+                config.set(section, "no_install_shutdown_handler", "true")
+                overridden_sections.append(section)
+        try:
+            root_tasks = await self._offload(self._setup_build, root_task)
+            logger.info("Scheduling tasks...")
+            # tasks are pushed in post-order, so futures of dependencies are always created before their dependents
+            self._pending_tasks = list(await self._offload(self._create_task_queue, root_tasks))
+            await self._wait_scheduled_tasks()
+        except BaseException:
+            for future in self.task_id_to_future.values():
+                future.cancel()
+            await asyncio.gather(*self.task_id_to_future.values(), return_exceptions=True)
+            if self.cancel_children_on_failure:
+                await self._offload(self._cancel_running_child_jobs)
+            raise
+        finally:
+            await self._offload(self._teardown_build)
+            # threads running tasks on master job cannot be interrupted, so they are not waited here
+            self._thread_pool.shutdown(wait=False)
+            # restore the config not to affect luigi workers running on the main thread after the build
+            for section in overridden_sections:
+                config.remove_option(section, "no_install_shutdown_handler")
+
+        if self.inline_runtime_threshold_sec is not None:
+            logger.info(f"Placement of TaskOnBullet: {self.placement_counts['child']} on child jobs, {self.placement_counts['master']} on master job.")
+        logger.info("All tasks completed!")
+
+    async def _offload(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._thread_pool, functools.partial(func, *args))
+
+    async def _wait_scheduled_tasks(self) -> None:
+        while True:
+            await self._start_pending_tasks()
+            running_futures = [future for future in self.task_id_to_future.values() if not future.done()]
+            if not running_futures:
+                # root tasks may be added while the last task is running
+                if self.added_root_tasks.empty():
+                    break
+                continue
+            done, _ = await asyncio.wait(running_futures, timeout=self.poll_interval_sec, return_when=asyncio.FIRST_EXCEPTION)
+            self._log_running_summary(
+                [task_id for task_id, future in self.task_id_to_future.items() if not future.done() and task_id in self.task_id_to_job_name])
+            for future in done:
+                if future.exception() is not None:
+                    raise future.exception()  # type: ignore
+
+    async def _start_pending_tasks(self) -> None:
+        if not self.added_root_tasks.empty():
+            await self._offload(self._schedule_added_root_tasks)
+        for task in self._pending_tasks:
+            self.task_id_to_future[task.make_unique_id()] = asyncio.ensure_future(self._run_task(task))
+        self._pending_tasks = []
+
+    def _schedule_added_root_tasks(self) -> None:
+        task_queue: deque[gokart.TaskOnKart] = deque()
+        self._enqueue_added_root_tasks(task_queue)
+        self._pending_tasks.extend(task_queue)
+
+    async def _run_task(self, task: gokart.TaskOnKart) -> None:
+        if await self._offload(task.complete):
+            logger.info(f"Task {self._gen_task_info(task)} is already completed.")
+            return
+        for child in flatten(task.requires()):
+            # shield dependencies not to cancel them even if this task is cancelled
+            await asyncio.shield(self.task_id_to_future[child.make_unique_id()])
+        self.task_id_to_ready_at.setdefault(task.make_unique_id(), time())
+
+        if isinstance(task, TaskOnBullet) and await self._offload(self._decide_placement, task) == "child":
+            await self._run_bullet_task(task)
+        elif isinstance(task, gokart.TaskOnKart):
+            async with self._master_task_lock:
+                await self._offload(self._exec_master_task, task)
+        else:
+            raise TypeError(f"Invalid task type: {type(task)}")
+
+    async def _run_bullet_task(self, task: TaskOnBullet) -> None:
+        if self._child_job_semaphore is None:
+            await self._run_bullet_task_on_child_job(task)
+            return
+        if self._child_job_semaphore.locked():
+            logger.info(f"Reach max_child_jobs, waiting to run task {self._gen_task_info(task)} on child job...")
+        async with self._child_job_semaphore:
+            await self._run_bullet_task_on_child_job(task)
+
+    async def _run_bullet_task_on_child_job(self, task: TaskOnBullet) -> None:
+        logger.info(f"Trying to run task {self._gen_task_info(task)} on child job...")
+        await self._offload(self._exec_bullet_task, task, self.remote_config_path)
+        # speculative job takes another slot of max_child_jobs until the task is completed
+        speculative_slot_acquired = False
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval_sec)
+                if await self._offload(task.complete):
+                    # runtime is recorded last, since it must be recorded only once
+                    if await self._offload(self._resolve_speculative_jobs, task) and await self._offload(self._record_node_locality, task) \
+                            and await self._offload(self._cleanup_child_job, task) and await self._offload(self._record_runtime, task):
+                        break
+                    continue
+                await self._offload(self._check_child_task_status, task)
+                logger.debug(f"Task {self._gen_task_info(task)} is still running on child job.")
+                if self.speculative_percentile is None or speculative_slot_acquired or \
+                        (self._child_job_semaphore is not None and self._child_job_semaphore.locked()):
+                    continue
+                # take the free slot before the launch, since other tasks may take it while the launch is offloaded.
+                # acquire() returns without suspending right after locked() is checked.
+                if self._child_job_semaphore is not None:
+                    await self._child_job_semaphore.acquire()
+                    speculative_slot_acquired = True
+                await self._offload(self._launch_speculative_job_if_straggling, task, self.remote_config_path)
+                if self._child_job_semaphore is not None and speculative_slot_acquired and task.make_unique_id() not in self.task_id_to_speculative_job_name:
+                    # not straggling, so give the slot back
+                    self._child_job_semaphore.release()
+                    speculative_slot_acquired = False
+        finally:
+            if speculative_slot_acquired and self._child_job_semaphore is not None:
+                self._child_job_semaphore.release()
+        logger.info(f"Task {self._gen_task_info(task)} is already completed.")
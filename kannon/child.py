@@ -0,0 +1,89 @@
+""" Helpers to run a TaskOnBullet on child jobs or child processes. """
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import tempfile
+from multiprocessing.util import Finalize
+from time import time
+
+import gokart
+import luigi
+from gokart.target import make_target
+
+from .config import ConfigBundle
+from .log_stream import PROGRESS_PREFIX
+from .node_cache import NODE_LOCAL_CACHE_DIR_ENV, NODE_LOCAL_CACHE_MAX_BYTES_ENV, NODE_NAME_ENV, get_cached_output_size, use_node_local_cache
+from .profiling import PROFILE_MODES_ENV, gen_profile_path, measure_peak_rss, profile_execution
+
+logger = logging.getLogger(__name__)
+
+# Remote config bundles already loaded in this process, since worker processes of executors run many tasks.
+_loaded_remote_config_paths: set[str] = set()
+
+
+def load_remote_config(remote_config_path: str) -> None:
+    """Download a config bundle saved by the master and add its config files to luigi config in order.
+
+    Each bundle is loaded only once per process, and its local files are removed when the process exits.
+    """
+    if remote_config_path in _loaded_remote_config_paths:
+        return
+    bundle: ConfigBundle = make_target(remote_config_path).load()
+    local_config_dir = tempfile.mkdtemp(prefix="kannon-conf-")
+    # luigi re-reads all config files whenever a config path is added, so they are kept until exit.
+    # unlike atexit, finalizers of multiprocessing are also called on exit of forked worker processes.
+    Finalize(None, shutil.rmtree, args=(local_config_dir, ), kwargs=dict(ignore_errors=True), exitpriority=0)
+    for i, (file_name, content) in enumerate(bundle):
+        # config files in the bundle are already converted to .ini format
+        local_config_path = os.path.join(local_config_dir, f"{i:03d}_{os.path.splitext(file_name)[0]}.ini")
+        with open(local_config_path, "w") as f:
+            f.write(content)
+        luigi.configuration.LuigiConfigParser.add_config_path(local_config_path)
+    _loaded_remote_config_paths.add(remote_config_path)
+    logger.info(f"Remote config bundle {remote_config_path} is loaded.")
+
+
+def gen_report_path(task_pkl_path: str) -> str:
+    """Path of the execution report which is saved next to the task pickle."""
+    return f"{os.path.splitext(task_pkl_path)[0]}_report.pkl"
+
+
+def report_progress(done: int, total: int, message: str = "") -> None:
+    """Print a progress line of the running task, which is summarized by the master if `stream_child_logs` is enabled."""
+    print(f"{PROGRESS_PREFIX} {done}/{total} {message}".rstrip(), flush=True)
+
+
+def run_task_on_bullet(task_pkl_path: str, remote_config_path: str | None = None, profile_modes: list[str] | None = None) -> None:
+    """Load a pickled task dumped by the master and run it with `gokart.build`.
+
+    Wall time and peak RSS of the execution are reported to the master via `gen_report_path(task_pkl_path)`.
+    If `profile_modes` is given, or set by the master via envvar, the profile is saved at `gen_profile_path(task_pkl_path)`.
+    If the node-local cache is enabled by the master, inputs and outputs of the task go through the cache,
+    and the node name and the cached output size are reported for placement of downstream tasks.
+    """
+    started_at = time()
+    if remote_config_path:
+        load_remote_config(remote_config_path)
+    if profile_modes is None:
+        profile_modes = [mode for mode in os.environ.get(PROFILE_MODES_ENV, "").split(",") if mode]
+    task: gokart.TaskOnKart = make_target(task_pkl_path).load()
+    node_local_cache_dir = os.environ.get(NODE_LOCAL_CACHE_DIR_ENV)
+    if node_local_cache_dir:
+        max_bytes = os.environ.get(NODE_LOCAL_CACHE_MAX_BYTES_ENV)
+        use_node_local_cache(task, node_local_cache_dir, max_bytes=int(max_bytes) if max_bytes else None)
+    # peak RSS is measured per task, since worker processes of executors run many tasks
+    with measure_peak_rss() as memory:
+        if profile_modes:
+            logger.info(f"Profiling task with modes {profile_modes}...")
+            with profile_execution(profile_modes) as profile:
+                gokart.build(task, return_value=False)
+            make_target(gen_profile_path(task_pkl_path)).dump(profile)
+        else:
+            gokart.build(task, return_value=False)
+    finished_at = time()
+    report = dict(started_at=started_at, finished_at=finished_at, peak_rss=memory["peak_rss"], node_name=os.environ.get(NODE_NAME_ENV))
+    if node_local_cache_dir:
+        report["output_size"] = get_cached_output_size(task, node_local_cache_dir)
+    make_target(gen_report_path(task_pkl_path)).dump(report)
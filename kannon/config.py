@@ -0,0 +1,109 @@
+""" Dynamic config files handed over from the master to child jobs. """
+from __future__ import annotations
+
+import configparser
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+from typing import Any, List, Tuple
+
+from gokart.target import make_target
+
+logger = logging.getLogger(__name__)
+
+INI_EXTENSIONS = (".ini", ".cfg")
+TOML_EXTENSIONS = (".toml", )
+YAML_EXTENSIONS = (".yaml", ".yml")
+SUPPORTED_EXTENSIONS = INI_EXTENSIONS + TOML_EXTENSIONS + YAML_EXTENSIONS
+
+# list of (file name, content in .ini format) in the order to be loaded
+ConfigBundle = List[Tuple[str, str]]
+
+
+def upload_config_bundle(config_paths: list[str], remote_config_dir: str) -> str:
+    """Bundle given config files into a single archive and save it in `remote_config_dir`.
+
+    The archive is named after the hash of its content, so it is uploaded only if any of the config files has changed.
+    """
+    bundle = create_config_bundle(config_paths)
+    remote_config_path = os.path.join(remote_config_dir, f"config_bundle_{gen_bundle_hash(bundle)}.pkl")
+    target = make_target(remote_config_path)
+    if target.exists():
+        logger.info(f"Config files are not changed. Reuse remote {remote_config_path}.")
+    else:
+        target.dump(bundle)
+        logger.info(f"Config files are bundled and saved at remote {remote_config_path}.")
+    return remote_config_path
+
+
+def create_config_bundle(config_paths: list[str]) -> ConfigBundle:
+    bundle: ConfigBundle = []
+    for config_path in config_paths:
+        logger.info(f"Handling given config file {config_path}")
+        bundle.append((os.path.basename(config_path), convert_to_ini(config_path)))
+    return bundle
+
+
+def gen_bundle_hash(bundle: ConfigBundle) -> str:
+    hash_obj = hashlib.sha256()
+    for file_name, content in bundle:
+        hash_obj.update(file_name.encode())
+        hash_obj.update(b"\0")
+        hash_obj.update(content.encode())
+        hash_obj.update(b"\0")
+    return hash_obj.hexdigest()[:16]
+
+
+def convert_to_ini(config_path: str) -> str:
+    """Load a config file and convert it to .ini format which luigi can load.
+
+    .toml and .yaml files have to be mappings from section names to mappings of options.
+    """
+    extension = os.path.splitext(config_path)[1]
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Format {config_path} is not supported. Supported formats are {SUPPORTED_EXTENSIONS}.")
+    with open(config_path) as f:
+        content = f.read()
+    if extension in INI_EXTENSIONS:
+        # keep as it is, since luigi resolves ${ENV_VAR} in .ini files on child jobs
+        return content
+    if extension in TOML_EXTENSIONS:
+        sections = _load_toml(content)
+    else:
+        sections = _load_yaml(content)
+    return _dump_ini(sections, config_path)
+
+
+def _load_toml(content: str) -> Any:
+    if sys.version_info >= (3, 11):
+        import tomllib
+        return tomllib.loads(content)
+    try:
+        import toml
+    except ImportError:
+        raise ImportError("toml is required to use .toml config files with python < 3.11. Please install it by `pip install toml`.")
+    return toml.loads(content)
+
+
+def _load_yaml(content: str) -> Any:
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("PyYAML is required to use .yaml config files. Please install it by `pip install pyyaml`.")
+    return yaml.safe_load(content)
+
+
+def _dump_ini(sections: Any, config_path: str) -> str:
+    if not isinstance(sections, dict) or not all(isinstance(options, dict) for options in sections.values()):
+        raise ValueError(f"Config file {config_path} must be a mapping from section names to mappings of options.")
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str  # type: ignore  # keep case of option names
+    for section, options in sections.items():
+        # non-string values are dumped as JSON, which luigi parameters can parse
+        parser[section] = {key: value if isinstance(value, str) else json.dumps(value) for key, value in options.items()}
+    buffer = io.StringIO()
+    parser.write(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import abc
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .child import run_task_on_bullet
+from .kube_util import JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class BulletExecutor(abc.ABC):
+    """Backend to run TaskOnBullet instead of kubernetes child jobs.
+
+    Each task is handed over as a pickle dumped by the master, and is identified by a job name generated by the master.
+    """
+
+    @abc.abstractmethod
+    def submit(self, job_name: str, task_pkl_path: str, remote_config_path: str | None, profile_modes: list[str] | None = None) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_status(self, job_name: str) -> JobStatus:
+        pass
+
+    @abc.abstractmethod
+    def cancel(self, job_name: str) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class LocalProcessExecutor(BulletExecutor):
+    """Run TaskOnBullet in a local process pool, e.g. to use all cores of a single machine without kubernetes."""
+
+    def __init__(self, max_workers: int | None = None) -> None:
+        if max_workers is not None and max_workers <= 0:
+            raise ValueError(f"max_workers must be positive integer, but got {max_workers}")
+        self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        self._job_name_to_future: dict[str, Future[None]] = dict()
+
+    def submit(self, job_name: str, task_pkl_path: str, remote_config_path: str | None, profile_modes: list[str] | None = None) -> None:
+        # profile modes are always given explicitly, not to inherit the envvar of the master
+        self._job_name_to_future[job_name] = self._pool.submit(run_task_on_bullet, task_pkl_path, remote_config_path, profile_modes or [])
+        logger.debug(f"Process submitted. name={job_name}")
+
+    def get_status(self, job_name: str) -> JobStatus:
+        future = self._job_name_to_future[job_name]
+        if not future.done():
+            return JobStatus.RUNNING
+        if future.cancelled():
+            return JobStatus.FAILED
+        exception = future.exception()
+        if exception is not None:
+            logger.error(f"Process {job_name} has failed.", exc_info=exception)
+            return JobStatus.FAILED
+        return JobStatus.SUCCEEDED
+
+    def cancel(self, job_name: str) -> None:
+        # a running process cannot be interrupted, so it is cancelled only if it has not started yet
+        if not self._job_name_to_future[job_name].cancel():
+            logger.warning(f"Process {job_name} is already running and cannot be cancelled.")
+
+    def shutdown(self) -> None:
+        for future in self._job_name_to_future.values():
+            future.cancel()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> LocalProcessExecutor:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.shutdown()
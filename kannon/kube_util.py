@@ -1,9 +1,20 @@
+from __future__ import annotations
+
 import enum
+import functools
 import logging
 import random
+import threading
+import uuid
+from collections import Counter
 from datetime import datetime
+from time import monotonic, sleep
+from typing import Any, Callable, Union
 
+import urllib3
 from kubernetes import client
+from kubernetes.client import rest
+from kubernetes.client.rest import ApiException
 
 logger = logging.getLogger(__name__)
 
@@ -18,16 +29,163 @@ class JobStatus(enum.Enum):
 # https://kubernetes.io/docs/concepts/overview/working-with-objects/names/#names
 JOB_NAME_MAX_LENGTH = 63
 
+# Waiting reasons of containers which will not recover without any intervention.
+STUCK_CONTAINER_REASONS = frozenset([
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+    "CrashLoopBackOff",
+    "CreateContainerConfigError",
+    "CreateContainerError",
+])
+
+# Status codes of transient errors, which are worth retrying.
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class TokenBucket:
+    """Thread-safe token bucket which allows `burst` calls at once and `qps` calls per second on average."""
+
+    def __init__(self, qps: float, burst: int) -> None:
+        if qps <= 0:
+            raise ValueError(f"qps must be positive, but got {qps}")
+        if burst <= 0:
+            raise ValueError(f"burst must be positive integer, but got {burst}")
+        self.qps = qps
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting until it is available. Returns the waited seconds."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.qps)
+            self._updated_at = now
+            # reserve the token in advance, so that waiting callers are served in order without holding the lock
+            self._tokens -= 1
+            wait_sec = -self._tokens / self.qps if self._tokens < 0 else 0.0
+        if wait_sec > 0:
+            sleep(wait_sec)
+        return wait_sec
+
+
+class ThrottledApi:
+    """Wrapper of kubernetes API instances such as `client.BatchV1Api` to protect both the master and the API server under load.
+
+    - API calls are limited by a token bucket of `qps` and `burst`.
+    - API calls failed with `RETRYABLE_STATUS_CODES` or connection errors are retried up to `max_retries` times
+      with exponential backoff and full jitter. `Retry-After` header is respected.
+      Since a failed request may have been applied on the server, a retried `create_*` call failed with 409 Conflict
+      is regarded as success and returns None.
+    - Connection pool of the underlying api client is resized to `connection_pool_maxsize` if given.
+
+    Numbers of requests, throttled requests, retries and failures are counted in `counters`.
+    """
+
+    def __init__(
+        self,
+        api_instance: Any,
+        qps: float = 20.0,
+        burst: int = 40,
+        max_retries: int = 5,
+        backoff_base_sec: float = 0.5,
+        backoff_max_sec: float = 30.0,
+        connection_pool_maxsize: int | None = None,
+    ) -> None:
+        if max_retries < 0:
+            raise ValueError(f"max_retries must be non-negative integer, but got {max_retries}")
+        self._api_instance = api_instance
+        self._token_bucket = TokenBucket(qps, burst)
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        if connection_pool_maxsize is not None:
+            set_connection_pool_maxsize(api_instance.api_client, connection_pool_maxsize)
+        self.counters: Counter[str] = Counter()
+        self._counters_lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api_instance, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def _wrapper(*args: Any, **kwargs: Any) -> Any:
+            return self._call(name, attr, args, kwargs)
+
+        return _wrapper
+
+    def _call(self, method_name: str, method: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            if self._token_bucket.acquire() > 0:
+                self._count("throttled")
+            self._count("requests")
+            try:
+                return method(*args, **kwargs)
+            except ApiException as e:
+                if e.status == 409 and attempt > 0 and method_name.startswith("create"):
+                    self._count("conflicts")
+                    logger.warning(f"Kubernetes API call {method_name} conflicted on retry. Regard the previous attempt as succeeded.")
+                    return None
+                if e.status not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                retry_after = _parse_retry_after(e)
+                reason = f"status={e.status}"
+            except urllib3.exceptions.HTTPError as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                retry_after = None
+                reason = repr(e)
+            # exponential backoff with full jitter
+            delay = random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * 2**attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            self._count("retries")
+            logger.warning(f"Kubernetes API call {method_name} failed with {reason}. Retry in {delay:.1f}s ({attempt + 1}/{self.max_retries}).")
+            sleep(delay)
+        raise AssertionError("unreachable")
+
+    def _count(self, key: str) -> None:
+        with self._counters_lock:
+            self.counters[key] += 1
+
 
-def create_job(api_instance: client.BatchV1Api, job: client.V1Job, namespace: str) -> None:
+# API instances accepted by the helpers below, which may be wrapped by ThrottledApi.
+BatchApi = Union[client.BatchV1Api, ThrottledApi]
+CoreApi = Union[client.CoreV1Api, ThrottledApi]
+
+
+def set_connection_pool_maxsize(api_client: client.ApiClient, maxsize: int) -> None:
+    """Resize the connection pool of given api client, which is 4 by default and blocks bursts of parallel calls."""
+    if maxsize <= 0:
+        raise ValueError(f"maxsize must be positive integer, but got {maxsize}")
+    api_client.configuration.connection_pool_maxsize = maxsize
+    api_client.rest_client = rest.RESTClientObject(api_client.configuration)
+
+
+def _parse_retry_after(e: ApiException) -> float | None:
+    if not e.headers or "Retry-After" not in e.headers:
+        return None
+    try:
+        return float(e.headers["Retry-After"])
+    except ValueError:
+        return None
+
+
+def create_job(api_instance: BatchApi, job: client.V1Job | dict[str, Any], namespace: str) -> None:
     api_response = api_instance.create_namespaced_job(
         body=job,
         namespace=namespace,
     )
-    logger.debug(f"Job created. status={api_response.status}")
+    # api_response is None if the job was created by a retried request of ThrottledApi
+    logger.debug(f"Job created. status={api_response.status if api_response is not None else None}")
 
 
-def get_job_status(api_instance: client.BatchV1Api, job_name: str, namespace: str) -> JobStatus:
+def get_job_status(api_instance: BatchApi, job_name: str, namespace: str) -> JobStatus:
     api_response = api_instance.read_namespaced_job_status(name=job_name, namespace=namespace)
     if (api_response.status.succeeded is not None or api_response.status.failed is not None):
         final_status = (JobStatus.SUCCEEDED if api_response.status.succeeded else JobStatus.FAILED)
@@ -35,8 +193,74 @@ def get_job_status(api_instance: client.BatchV1Api, job_name: str, namespace: st
     return JobStatus.RUNNING
 
 
+def list_pods_by_job_name(api_instance: CoreApi, namespace: str, label_selector: str) -> dict[str, list[client.V1Pod]]:
+    """List pods matching the label selector by a single call, and index them by the names of their jobs."""
+    api_response = api_instance.list_namespaced_pod(namespace=namespace, label_selector=label_selector)
+    job_name_to_pods: dict[str, list[client.V1Pod]] = dict()
+    for pod in api_response.items:
+        job_name = (pod.metadata.labels or {}).get("job-name")
+        if job_name is not None:
+            job_name_to_pods.setdefault(job_name, []).append(pod)
+    return job_name_to_pods
+
+
+def get_stuck_pod_reason(pods: list[client.V1Pod]) -> str | None:
+    """Return the reason why the pods of a job are stuck, or None if any of them is making progress."""
+    active_pods = [pod for pod in pods if pod.status.phase in ("Pending", "Running")]
+    if not active_pods:
+        return None
+    reasons = []
+    for pod in active_pods:
+        reason = _get_stuck_reason(pod)
+        if reason is None:
+            return None
+        reasons.append(f"{pod.metadata.name}: {reason}")
+    return ", ".join(reasons)
+
+
+def _get_stuck_reason(pod: client.V1Pod) -> str | None:
+    for condition in pod.status.conditions or []:
+        if condition.type == "PodScheduled" and condition.status == "False" and condition.reason == "Unschedulable":
+            return f"Unschedulable ({condition.message})"
+    container_statuses = (pod.status.init_container_statuses or []) + (pod.status.container_statuses or [])
+    for container_status in container_statuses:
+        waiting = container_status.state.waiting if container_status.state else None
+        if waiting is not None and waiting.reason in STUCK_CONTAINER_REASONS:
+            return f"{waiting.reason} ({waiting.message})"
+    return None
+
+
+def delete_job(api_instance: BatchApi, job_name: str, namespace: str, propagation_policy: str = "Background") -> None:
+    # propagate deletion to pods owned by the job.
+    # with "Foreground", the job is kept until all of its pods are deleted, which can be checked by `job_exists`.
+    try:
+        api_instance.delete_namespaced_job(
+            name=job_name,
+            namespace=namespace,
+            propagation_policy=propagation_policy,
+        )
+    except ApiException as e:
+        # the job may have been already deleted, e.g. by ttlSecondsAfterFinished
+        if e.status != 404:
+            raise
+        logger.debug(f"Job is already deleted. name={job_name}")
+        return
+    logger.debug(f"Job deleted. name={job_name}")
+
+
+def job_exists(api_instance: BatchApi, job_name: str, namespace: str) -> bool:
+    try:
+        api_instance.read_namespaced_job(name=job_name, namespace=namespace)
+    except ApiException as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
 def gen_job_name(job_prefix: str) -> str:
-    job_suffix = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{str(random.randint(0, 255)).zfill(3)}"
+    # random part is long enough not to collide even if many jobs are launched within a second, e.g. by AsyncKannon
+    job_suffix = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
     job_prefix = job_prefix[:JOB_NAME_MAX_LENGTH - 1 - len(job_suffix)]
     job_name = f"{job_prefix}-{job_suffix}"
     job_name = job_name.replace("_", "-").lower()
@@ -0,0 +1,173 @@
+""" Streaming of logs of child jobs into the master. """
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from collections import deque
+from time import sleep, time
+from typing import Any, Callable, TextIO
+
+from kubernetes import client
+
+from .kube_util import ThrottledApi
+
+logger = logging.getLogger(__name__)
+
+# Prefix of progress lines printed by `kannon.child.report_progress`, e.g. "KANNON_PROGRESS 3/10 loading".
+PROGRESS_PREFIX = "KANNON_PROGRESS"
+PROGRESS_PATTERN = re.compile(PROGRESS_PREFIX + r"\s+(\d+)/(\d+)\s*(.*)")
+
+POD_POLL_INTERVAL_SEC = 2.0
+STARTED_POD_PHASES = ("Running", "Succeeded", "Failed")
+
+
+def parse_progress(line: str) -> str | None:
+    """Parse a progress line into a summary like "3/10 (30%) loading", or return None for other lines."""
+    match = PROGRESS_PATTERN.search(line)
+    if match is None:
+        return None
+    done, total, message = int(match.group(1)), int(match.group(2)), match.group(3).strip()
+    progress = f"{done}/{total}"
+    if total > 0:
+        progress += f" ({100 * done / total:.0f}%)"
+    return f"{progress} {message}" if message else progress
+
+
+class ChildLogStreamer:
+    """Follow logs of pods of child jobs, and write them into a single sink with task prefixes.
+
+    At most `max_streams` logs are followed at once, and the other jobs wait in FIFO order.
+    A slot is taken while waiting for the pod to start, so that the number of threads is also bounded.
+    Pods are looked up by `list_pods(job_name, listed_after)`, which returns pods of the job listed at `listed_after` or later,
+    so that waiting streams share pods listed for all child jobs at once instead of listing them for each job.
+    Pods recreated by the job controller up to `backoffLimit` are followed in turn, until a pod succeeds or the job is stopped.
+    """
+
+    def __init__(self,
+                 core_api_instance: client.CoreV1Api | ThrottledApi,
+                 namespace: str,
+                 list_pods: Callable[[str, float], list[client.V1Pod]],
+                 sink: TextIO,
+                 max_streams: int = 16) -> None:
+        if max_streams <= 0:
+            raise ValueError(f"max_streams must be positive integer, but got {max_streams}")
+        self._core_api_instance = core_api_instance
+        self._namespace = namespace
+        self._list_pods = list_pods
+        self._sink = sink
+        self._max_streams = max_streams
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self._job_name_to_stopped_at: dict[str, float] = dict()
+        self._pending_jobs: deque[tuple[str, str]] = deque()
+        self._threads: dict[str, threading.Thread] = dict()
+        self._job_name_to_response: dict[str, Any] = dict()
+        self.job_name_to_task_info: dict[str, str] = dict()
+        self.job_name_to_progress: dict[str, str] = dict()
+
+    def start(self, job_name: str, task_info: str) -> None:
+        """Start following logs of the job, or enqueue it if `max_streams` logs are being followed."""
+        with self._lock:
+            if self._closed:
+                return
+            self.job_name_to_task_info[job_name] = task_info
+            self._pending_jobs.append((job_name, task_info))
+            self._start_pending_streams()
+
+    def stop(self, job_name: str) -> None:
+        """Stop waiting for pods of the job to start, since the job has finished or has been deleted.
+
+        Logs of pods which have already started are still followed to the end.
+        """
+        with self._lock:
+            self._job_name_to_stopped_at[job_name] = time()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Wait for running and pending streams to reach the end of logs up to `timeout` seconds, and stop all of them."""
+        deadline = time() + timeout
+        while time() < deadline:
+            # pending streams are started when running ones end
+            with self._lock:
+                threads = list(self._threads.values())
+            if not threads:
+                break
+            for thread in threads:
+                thread.join(max(deadline - time(), 0.0))
+        with self._lock:
+            self._closed = True
+            self._pending_jobs.clear()
+            responses = list(self._job_name_to_response.values())
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def _start_pending_streams(self) -> None:
+        # should be called with the lock
+        while self._pending_jobs and len(self._threads) < self._max_streams:
+            job_name, task_info = self._pending_jobs.popleft()
+            thread = threading.Thread(target=self._stream, args=(job_name, task_info), name=f"kannon-log-{job_name}", daemon=True)
+            self._threads[job_name] = thread
+            thread.start()
+
+    def _stream(self, job_name: str, task_info: str) -> None:
+        streamed_pod_names: set[str] = set()
+        try:
+            while True:
+                pod_name = self._wait_pod_started(job_name, streamed_pod_names)
+                if pod_name is None:
+                    return
+                streamed_pod_names.add(pod_name)
+                self._stream_pod(job_name, task_info, pod_name)
+        except Exception:
+            # pods of stopped jobs may have been deleted
+            if not self._closed and job_name not in self._job_name_to_stopped_at:
+                logger.warning(f"Failed to stream logs of child job {job_name}.", exc_info=True)
+        finally:
+            with self._lock:
+                self._job_name_to_response.pop(job_name, None)
+                del self._threads[job_name]
+                if not self._closed:
+                    self._start_pending_streams()
+
+    def _stream_pod(self, job_name: str, task_info: str, pod_name: str) -> None:
+        response = self._core_api_instance.read_namespaced_pod_log(name=pod_name, namespace=self._namespace, follow=True, _preload_content=False)
+        with self._lock:
+            self._job_name_to_response[job_name] = response
+        buffer = b""
+        for chunk in response.stream(4096):
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                self._write_line(job_name, task_info, line.decode("utf-8", errors="replace"))
+        if buffer:
+            self._write_line(job_name, task_info, buffer.decode("utf-8", errors="replace"))
+
+    def _wait_pod_started(self, job_name: str, streamed_pod_names: set[str]) -> str | None:
+        """Name of a started pod of the job which is not streamed yet, or None if no more pods are expected."""
+        while not self._closed:
+            # pods listed before the job is stopped may miss a pod started just before it, so require pods listed after it
+            stopped_at = self._job_name_to_stopped_at.get(job_name)
+            pods = self._list_pods(job_name, stopped_at if stopped_at is not None else 0.0)
+            for pod in pods:
+                if pod.status is None or pod.metadata.name in streamed_pod_names:
+                    continue
+                if pod.status.phase in STARTED_POD_PHASES:
+                    return pod.metadata.name
+            # the job is completed once any of its pods has succeeded
+            if stopped_at is not None or any(pod.status is not None and pod.status.phase == "Succeeded" for pod in pods):
+                return None
+            sleep(POD_POLL_INTERVAL_SEC)
+        return None
+
+    def _write_line(self, job_name: str, task_info: str, line: str) -> None:
+        progress = parse_progress(line)
+        with self._lock:
+            if self._closed:
+                return
+            if progress is not None:
+                self.job_name_to_progress[job_name] = progress
+            self._sink.write(f"[{task_info}] {line}\n")
+            self._sink.flush()
@@ -2,28 +2,51 @@ from __future__ import annotations
 
 import logging
 import os
-from collections import deque
-from copy import deepcopy
-from time import sleep
+import queue
+import sys
+import threading
+import uuid
+from collections import Counter, deque
+from time import sleep, time
+from typing import Any, Collection, Literal, Sequence, TextIO
 
 import gokart
-from gokart.target import make_target
+from gokart.target import SingleFileTarget, make_target
 from kubernetes import client
+from kubernetes.client.rest import ApiException
 from luigi.task import flatten
 
-from .kube_util import JobStatus, create_job, gen_job_name, get_job_status
+from .child import gen_report_path
+from .config import upload_config_bundle
+from .executor import BulletExecutor
+from .kube_util import JobStatus, ThrottledApi, create_job, delete_job, gen_job_name, get_job_status, get_stuck_pod_reason, job_exists, list_pods_by_job_name
+from .log_stream import ChildLogStreamer
+from .node_cache import NODE_LOCAL_CACHE_DIR_ENV, NODE_LOCAL_CACHE_MAX_BYTES_ENV, NODE_NAME_ENV
+from .profiling import PROFILE_MODES_ENV, gen_profile_path, validate_profile_modes
+from .stats import TaskStatsStore
 from .task import TaskOnBullet
+from .util import percentile
 
 logger = logging.getLogger(__name__)
 
+# TTL of finished child jobs which have no owner reference to the master pod, not to leak them forever.
+DEFAULT_TTL_SECONDS_AFTER_FINISHED = 24 * 60 * 60
+
+# Label of pods of child jobs to list all of them in a build by a single call.
+BUILD_ID_LABEL = "kannon-build-id"
+# Pods of child jobs are listed at most once per this interval to detect stuck ones.
+POD_LIST_INTERVAL_SEC = 10.0
+# Max seconds to wait for profiled child jobs to exit at the end of the build, not to hang on jobs which cannot be cancelled.
+PROFILE_WAIT_TIMEOUT_SEC = 60.0
+
 
 class Kannon:
 
     def __init__(
         self,
         # k8s resources
-        api_instance: client.BatchV1Api,
-        template_job: client.V1Job,
+        api_instance: client.BatchV1Api | ThrottledApi | None,
+        template_job: client.V1Job | None,
         # kannon resources
         job_prefix: str,
         path_child_script: str = "./run_child.py",
@@ -32,14 +55,38 @@ class Kannon:
         master_pod_uid: str | None = None,
         dynamic_config_paths: list[str] | None = None,
         max_child_jobs: int | None = None,
+        speculative_percentile: float | None = None,
+        speculative_min_samples: int = 3,
+        ttl_seconds_after_finished: int | None = None,
+        delete_succeeded_jobs: bool = False,
+        cancel_children_on_failure: bool = True,
+        executor: BulletExecutor | None = None,
+        core_api_instance: client.CoreV1Api | ThrottledApi | None = None,
+        stuck_child_timeout_sec: float = 300.0,
+        stuck_child_policy: Literal["fail", "reschedule"] = "fail",
+        max_child_reschedules: int = 1,
+        inline_runtime_threshold_sec: float | None = None,
+        record_stats: bool = False,
+        profiling: dict[str, list[str]] | None = None,
+        node_local_cache_dir: str | None = None,
+        node_local_cache_max_bytes: int | None = 10 * 1024**3,
+        stream_child_logs: bool = False,
+        child_log_path: str | None = None,
+        max_log_streams: int = 16,
+        progress_log_interval_sec: float = 60.0,
     ) -> None:
         # validation
-        if not os.path.exists(path_child_script):
+        if executor is None and not os.path.exists(path_child_script):
             raise FileNotFoundError(f"Child script {path_child_script} does not exist.")
+        if executor is None and template_job is None:
+            raise ValueError("template_job is required to run tasks on kubernetes child jobs.")
 
         self.template_job = template_job
+        # the template is serialized only once, and each child job patches a shallow copy of it
+        self._template_job_body: dict[str, Any] | None = client.ApiClient().sanitize_for_serialization(template_job) if template_job is not None else None
         self.api_instance = api_instance
-        self.namespace = template_job.metadata.namespace
+        self.executor = executor
+        self.namespace = template_job.metadata.namespace if template_job is not None else None
         self.job_prefix = job_prefix
         self.path_child_script = path_child_script
         self.env_to_inherit = env_to_inherit
@@ -52,49 +99,202 @@ class Kannon:
             raise ValueError(f"max_child_jobs must be positive integer, but got {max_child_jobs}")
         self.max_child_jobs = max_child_jobs
 
+        if speculative_percentile is not None and not 0 < speculative_percentile <= 100:
+            raise ValueError(f"speculative_percentile must be in (0, 100], but got {speculative_percentile}")
+        if speculative_min_samples <= 0:
+            raise ValueError(f"speculative_min_samples must be positive integer, but got {speculative_min_samples}")
+        self.speculative_percentile = speculative_percentile
+        self.speculative_min_samples = speculative_min_samples
+
+        if ttl_seconds_after_finished is not None and ttl_seconds_after_finished < 0:
+            raise ValueError(f"ttl_seconds_after_finished must be non-negative integer, but got {ttl_seconds_after_finished}")
+        self.ttl_seconds_after_finished = ttl_seconds_after_finished
+        self.delete_succeeded_jobs = delete_succeeded_jobs
+        self.cancel_children_on_failure = cancel_children_on_failure
+
+        # pods of child jobs are watched only if CoreV1Api is given
+        if stuck_child_timeout_sec < 0:
+            raise ValueError(f"stuck_child_timeout_sec must be non-negative, but got {stuck_child_timeout_sec}")
+        if stuck_child_policy not in ("fail", "reschedule"):
+            raise ValueError(f"stuck_child_policy must be 'fail' or 'reschedule', but got {stuck_child_policy}")
+        if max_child_reschedules < 0:
+            raise ValueError(f"max_child_reschedules must be non-negative integer, but got {max_child_reschedules}")
+        self.core_api_instance = core_api_instance
+        self.stuck_child_timeout_sec = stuck_child_timeout_sec
+        self.stuck_child_policy = stuck_child_policy
+        self.max_child_reschedules = max_child_reschedules
+
+        if inline_runtime_threshold_sec is not None and inline_runtime_threshold_sec < 0:
+            raise ValueError(f"inline_runtime_threshold_sec must be non-negative, but got {inline_runtime_threshold_sec}")
+        self.inline_runtime_threshold_sec = inline_runtime_threshold_sec
+        self.placement_counts: Counter[str] = Counter()
+        # placement is decided on threads of AsyncKannon concurrently
+        self._placement_lock = threading.Lock()
+        self.task_id_to_placement: dict[str, Literal["child", "master"]] = dict()
+
+        # stats are saved under the workspace directory of root task, so the store is created on build
+        self.record_stats = record_stats
+        self.stats_store: TaskStatsStore | None = None
+
+        # profile modes of TaskOnBullet by task family, e.g. {"TaskC": ["cprofile", "rss"]}
+        for profile_modes in (profiling or {}).values():
+            validate_profile_modes(profile_modes)
+        self.profiling = profiling or {}
+        self.task_id_to_profiled_task: dict[str, TaskOnBullet] = dict()
+        self.profile_index: list[dict[str, str]] = []
+
+        # outputs of child jobs are cached on hostPath of each node, and downstream tasks prefer the node of their largest input
+        if node_local_cache_dir is not None and executor is not None:
+            raise ValueError("node_local_cache_dir is available only on kubernetes child jobs.")
+        if node_local_cache_dir is not None and not os.path.isabs(node_local_cache_dir):
+            raise ValueError(f"node_local_cache_dir must be an absolute path, but got {node_local_cache_dir}")
+        if node_local_cache_max_bytes is not None and node_local_cache_max_bytes <= 0:
+            raise ValueError(f"node_local_cache_max_bytes must be positive integer, but got {node_local_cache_max_bytes}")
+        self.node_local_cache_dir = node_local_cache_dir
+        self.node_local_cache_max_bytes = node_local_cache_max_bytes
+        self.task_id_to_node_locality: dict[str, tuple[str, int]] = dict()
+
+        # logs of pods of child jobs are followed via CoreV1Api, and written to `child_log_path` or stdout
+        if stream_child_logs and (core_api_instance is None or executor is not None):
+            raise ValueError("stream_child_logs requires core_api_instance and kubernetes child jobs.")
+        if max_log_streams <= 0:
+            raise ValueError(f"max_log_streams must be positive integer, but got {max_log_streams}")
+        if progress_log_interval_sec < 0:
+            raise ValueError(f"progress_log_interval_sec must be non-negative, but got {progress_log_interval_sec}")
+        self.stream_child_logs = stream_child_logs
+        self.child_log_path = child_log_path
+        self.max_log_streams = max_log_streams
+        self.progress_log_interval_sec = progress_log_interval_sec
+        self.log_streamer: ChildLogStreamer | None = None
+        self.running_summary_logged_at = 0.0
+
         self.task_id_to_job_name: dict[str, str] = dict()
+        self.task_id_to_speculative_job_name: dict[str, str] = dict()
+        # jobs which have lost the race of speculative execution, and are being deleted
+        self.task_id_to_terminating_job_name: dict[str, str] = dict()
+        self.task_id_to_ready_at: dict[str, float] = dict()
+        self.task_id_to_launched_at: dict[str, float] = dict()
+        # runtimes of tasks on child jobs from launch to completion, which are the baseline to detect stragglers
+        self.task_family_to_child_runtimes: dict[str, list[float]] = dict()
+        # wall times of tasks themselves on either master or child jobs, which are used to decide placement
+        self.task_family_to_wall_times: dict[str, list[float]] = dict()
+        self.job_name_to_final_status: dict[str, JobStatus] = dict()
+        self.job_name_to_stuck_since: dict[str, float] = dict()
+        self.task_id_to_reschedule_count: dict[str, int] = dict()
+        self.build_id = uuid.uuid4().hex
+        self.job_name_to_pods: dict[str, list[client.V1Pod]] = dict()
+        self.pods_listed_at = 0.0
+        self._pod_list_lock = threading.Lock()
+        self.remote_config_path: str | None = None
+        self.workspace_dir: str | None = None
+
+        self.visited_task_ids: set[str] = set()
+        self.added_root_tasks: queue.SimpleQueue[gokart.TaskOnKart] = queue.SimpleQueue()
+
+    def build(self, root_task: gokart.TaskOnKart | Sequence[gokart.TaskOnKart]) -> None:
+        """Build given root tasks and their dependencies. Tasks shared by multiple root tasks are built only once."""
+        root_tasks = self._setup_build(root_task)
+
+        # push tasks into queue
+        logger.info("Creating task queue...")
+        task_queue = self._create_task_queue(root_tasks)
 
-    def build(self, root_task: gokart.TaskOnKart) -> None:
-        # TODO: support multiple dynamic config files
-        # use workspace directory of root task as the root directory for remote cache
-        workspace_dir = root_task.workspace_directory
+        # consume task queue
+        logger.info("Consuming task queue...")
+        try:
+            self._consume_task_queue(task_queue, self.remote_config_path)
+        except BaseException:
+            if self.cancel_children_on_failure:
+                self._cancel_running_child_jobs()
+            raise
+        finally:
+            self._teardown_build()
+
+        if self.inline_runtime_threshold_sec is not None:
+            logger.info(f"Placement of TaskOnBullet: {self.placement_counts['child']} on child jobs, {self.placement_counts['master']} on master job.")
+        logger.info("All tasks completed!")
+
+    def add_root_task(self, root_task: gokart.TaskOnKart) -> None:
+        """Add a root task to the running build, or to the next build if no build is running.
+
+        This method is thread-safe. Tasks which are already in the running build are not scheduled twice.
+        """
+        self.added_root_tasks.put(root_task)
+
+    def _setup_build(self, root_task: gokart.TaskOnKart | Sequence[gokart.TaskOnKart]) -> list[gokart.TaskOnKart]:
+        """Prepare resources shared by child jobs, and return the list of root tasks."""
+        root_tasks = [root_task] if isinstance(root_task, gokart.TaskOnKart) else list(root_task)
+        if not root_tasks:
+            raise ValueError("At least one root task is required.")
+        # use workspace directory of the first root task as the root directory for remote cache
+        workspace_dir = root_tasks[0].workspace_directory
         remote_config_path = None
         if self.dynamic_config_paths:
-            assert len(self.dynamic_config_paths) == 1, "Currently kannon doesn't support multiple dynamic config files."
-            dynamic_config_path = self.dynamic_config_paths[0]
             logger.info("Handling dynamic config files...")
-            logger.info(f"Handling given config file {dynamic_config_path}")
             # save configs to remote cache
             remote_config_dir = os.path.join(workspace_dir, "kannon", "conf")
-            # TODO: support other format than .ini
-            if not dynamic_config_path.endswith(".ini"):
-                raise ValueError(f"Format {dynamic_config_path} is not supported.")
-            # load local config and save it to remote cache
-            local_conf_content = make_target(dynamic_config_path).load()
-            remote_config_path = os.path.join(remote_config_dir, os.path.basename(dynamic_config_path))
-            make_target(remote_config_path).dump(local_conf_content)
-            logger.info(f"local config file {dynamic_config_path} is saved at remote {remote_config_path}.")
+            remote_config_path = upload_config_bundle(self.dynamic_config_paths, remote_config_dir)
         else:
             logger.info("No dynamic config files are given.")
 
-        # push tasks into queue
-        logger.info("Creating task queue...")
-        task_queue = self._create_task_queue(root_task)
+        self.remote_config_path = remote_config_path
+        if self.record_stats:
+            self.stats_store = TaskStatsStore(os.path.join(workspace_dir, "kannon", "stats"))
+        self.visited_task_ids = set()
+        self.workspace_dir = workspace_dir
+        self.build_id = uuid.uuid4().hex
+        self.job_name_to_pods = dict()
+        self.pods_listed_at = 0.0
+        self.task_id_to_profiled_task = dict()
+        if self.stream_child_logs:
+            assert self.core_api_instance is not None and self.namespace is not None
+            self._child_log_sink: TextIO = open(self.child_log_path, "a") if self.child_log_path else sys.stdout
+            self.log_streamer = ChildLogStreamer(self.core_api_instance,
+                                                 self.namespace,
+                                                 self._get_child_pods,
+                                                 self._child_log_sink,
+                                                 max_streams=self.max_log_streams)
+        self.running_summary_logged_at = time()
+        return root_tasks
 
-        # consume task queue
+    def _teardown_build(self) -> None:
+        if self.stats_store is not None:
+            self.stats_store.flush()
+        if self.task_id_to_profiled_task:
+            self._collect_profiles()
+        if self.log_streamer is not None:
+            self.log_streamer.close()
+            self.log_streamer = None
+            if self.child_log_path:
+                self._child_log_sink.close()
+        for api_instance in [self.api_instance, self.core_api_instance]:
+            if isinstance(api_instance, ThrottledApi):
+                logger.info(f"Kubernetes API calls via {type(api_instance._api_instance).__name__}: {dict(api_instance.counters)}")
+
+    def _consume_task_queue(self, task_queue: deque[gokart.TaskOnKart], remote_config_path: str | None) -> None:
         running_task_ids: set[str] = set()
-        logger.info("Consuming task queue...")
-        while task_queue:
+        while True:
+            self._enqueue_added_root_tasks(task_queue)
+            if not task_queue:
+                break
             task = task_queue.popleft()
             if task.complete():
-                logger.info(f"Task {self._gen_task_info(task)} is already completed.")
                 if task.make_unique_id() in running_task_ids:
+                    # runtime is recorded last, since it must be recorded only once
+                    if not self._resolve_speculative_jobs(task) or not self._record_node_locality(task) or not self._cleanup_child_job(task) \
+                            or not self._record_runtime(task):
+                        task_queue.append(task)  # re-enqueue task to wait for the child job to exit
+                        continue
                     running_task_ids.remove(task.make_unique_id())
+                logger.info(f"Task {self._gen_task_info(task)} is already completed.")
                 continue
             if task.make_unique_id() in running_task_ids:
                 # check if task is still running on child job
                 self._check_child_task_status(task)
-                logger.info(f"Task {self._gen_task_info(task)} is still running on child job.")
+                logger.debug(f"Task {self._gen_task_info(task)} is still running on child job.")
+                self._log_running_summary(running_task_ids)
+                if not self._reach_max_child_jobs(running_task_ids):
+                    self._launch_speculative_job_if_straggling(task, remote_config_path)
                 task_queue.append(task)  # re-enqueue task to check if it is done
                 continue
 
@@ -105,9 +305,10 @@ class Kannon:
                 task_queue.append(task)  # re-enqueue task to check if it's executable later
                 logger.debug("Task is not executable yet. Re-enqueue task.")
                 continue
+            self.task_id_to_ready_at.setdefault(task.make_unique_id(), time())
             # execute task
-            if isinstance(task, TaskOnBullet):
-                if self.max_child_jobs is not None and len(running_task_ids) >= self.max_child_jobs:
+            if isinstance(task, TaskOnBullet) and self._decide_placement(task) == "child":
+                if self._reach_max_child_jobs(running_task_ids):
                     task_queue.append(task)  # re-enqueue task to check later
                     logger.info(f"Reach max_child_jobs, waiting to run task {self._gen_task_info(task)} on child job...")
                     continue
@@ -116,36 +317,61 @@ class Kannon:
                 running_task_ids.add(task.make_unique_id())  # mark as already launched task
                 task_queue.append(task)  # re-enqueue task to check if it is done
             elif isinstance(task, gokart.TaskOnKart):
-                logger.info(f"Executing task {self._gen_task_info(task)} on master job...")
-                self._exec_gokart_task(task)
-                logger.info(f"Completed task {self._gen_task_info(task)} on master job.")
+                self._exec_master_task(task)
             else:
                 raise TypeError(f"Invalid task type: {type(task)}")
 
-        logger.info("All tasks completed!")
+    def _reach_max_child_jobs(self, running_task_ids: set[str]) -> bool:
+        # speculative jobs take slots of max_child_jobs as well as original ones
+        num_child_jobs = len(running_task_ids) + len(self.task_id_to_speculative_job_name) + len(self.task_id_to_terminating_job_name)
+        return self.max_child_jobs is not None and num_child_jobs >= self.max_child_jobs
+
+    def _exec_master_task(self, task: gokart.TaskOnKart) -> None:
+        logger.info(f"Executing task {self._gen_task_info(task)} on master job...")
+        started_at = time()
+        self._exec_gokart_task(task)
+        wall_time = time() - started_at
+        if isinstance(task, TaskOnBullet):
+            self.task_family_to_wall_times.setdefault(task.get_task_family(), []).append(wall_time)
+        if self.stats_store is not None:
+            self.stats_store.record(task.get_task_family(), wall_time=wall_time, queue_wait=started_at - self.task_id_to_ready_at[task.make_unique_id()])
+        logger.info(f"Completed task {self._gen_task_info(task)} on master job.")
 
-    def _create_task_queue(self, root_task: gokart.TaskOnKart) -> deque[gokart.TaskOnKart]:
+    def _create_task_queue(self, root_tasks: gokart.TaskOnKart | Sequence[gokart.TaskOnKart]) -> deque[gokart.TaskOnKart]:
         task_queue: deque[gokart.TaskOnKart] = deque()
-        visited_task_ids: set[str] = set()
+        if isinstance(root_tasks, gokart.TaskOnKart):
+            root_tasks = [root_tasks]
+        for root_task in root_tasks:
+            self._enqueue_task_tree(root_task, task_queue)
+        logger.info(f"Total tasks in task queue: {len(task_queue)}")
+        return task_queue
+
+    def _enqueue_added_root_tasks(self, task_queue: deque[gokart.TaskOnKart]) -> None:
+        while not self.added_root_tasks.empty():
+            root_task = self.added_root_tasks.get()
+            logger.info(f"Root task {self._gen_task_info(root_task)} is added.")
+            self._enqueue_task_tree(root_task, task_queue)
+            logger.info(f"Total tasks in task queue: {len(task_queue)}")
+
+    def _enqueue_task_tree(self, root_task: gokart.TaskOnKart, task_queue: deque[gokart.TaskOnKart]) -> None:
+        """Push tasks which have not been visited in this build into task queue."""
 
         def _rec_enqueue_task(task: gokart.TaskOnKart) -> None:
             """Traversal task tree in post-order to push tasks into task queue."""
-            nonlocal task_queue, visited_task_ids
-
-            visited_task_ids.add(task.make_unique_id())
+            self.visited_task_ids.add(task.make_unique_id())
             # run children
             children = flatten(task.requires())
             for child in children:
-                if child.make_unique_id() in visited_task_ids:
+                if child.make_unique_id() in self.visited_task_ids:
                     continue
                 _rec_enqueue_task(child)
 
             task_queue.append(task)
             logger.info(f"Task {self._gen_task_info(task)} is pushed to task queue")
 
+        if root_task.make_unique_id() in self.visited_task_ids:
+            return
         _rec_enqueue_task(root_task)
-        logger.info(f"Total tasks in task queue: {len(task_queue)}")
-        return task_queue
 
     def _exec_gokart_task(self, task: gokart.TaskOnKart) -> None:
         # Run on master job
@@ -158,23 +384,344 @@ class Kannon:
         # Save task instance as pickle object
         pkl_path = self._gen_pkl_path(task)
         make_target(pkl_path).dump(task)
+        # remove the report and the profile of previous builds
+        stale_paths = [gen_report_path(pkl_path)] if self._reads_runtime_report() or self.node_local_cache_dir is not None else []
+        if self._get_profile_modes(task):
+            stale_paths.append(gen_profile_path(pkl_path))
+            self.task_id_to_profiled_task[task.make_unique_id()] = task
+        for stale_path in stale_paths:
+            stale_target = make_target(stale_path)
+            if stale_target.exists():
+                stale_target.remove()
         # Run on child job
         job_name = gen_job_name(self.job_prefix)
+        preferred_node_name = self._get_preferred_node_name(task)
+        self._submit_child_job(job_name, pkl_path, remote_config_path, profile_modes=self._get_profile_modes(task), preferred_node_name=preferred_node_name)
+        logger.info(f"Created child job {job_name} with task {self._gen_task_info(task)}")
+        if preferred_node_name:
+            logger.info(f"Child job {job_name} prefers node {preferred_node_name} where its largest input is cached.")
+        self.task_id_to_job_name[task.make_unique_id()] = job_name
+        self._start_log_stream(task, job_name)
+        self.task_id_to_launched_at[task.make_unique_id()] = time()
+
+    def _launch_speculative_job_if_straggling(self, task: TaskOnBullet, remote_config_path: str | None) -> None:
+        """Launch a duplicate child job when the task runs longer than the given percentile of its finished siblings."""
+        if self.speculative_percentile is None:
+            return
+        task_id = task.make_unique_id()
+        if task_id in self.task_id_to_speculative_job_name or task_id not in self.task_id_to_launched_at:
+            return
+        if not self._has_single_file_outputs(task):
+            return
+        runtimes = self.task_family_to_child_runtimes.get(task.get_task_family(), [])
+        if len(runtimes) < self.speculative_min_samples:
+            return
+        threshold = percentile(runtimes, self.speculative_percentile)
+        elapsed = time() - self.task_id_to_launched_at[task_id]
+        if elapsed <= threshold:
+            return
+
+        # the task pickle has been dumped already when the original job was launched
+        original_job_name = self.task_id_to_job_name[task_id]
+        job_name = gen_job_name(self.job_prefix)
+        self._submit_child_job(
+            job_name,
+            self._gen_pkl_path(task),
+            remote_config_path,
+            anti_affinity_job_name=original_job_name,
+            profile_modes=self._get_profile_modes(task),
+        )
+        logger.info(f"Task {self._gen_task_info(task)} has been running for {elapsed:.1f}s (p{self.speculative_percentile:g} of siblings is {threshold:.1f}s). "
+                    f"Created speculative child job {job_name} as a duplicate of {original_job_name}.")
+        self.task_id_to_speculative_job_name[task_id] = job_name
+        self._start_log_stream(task, job_name)
+
+    def _resolve_speculative_jobs(self, task: TaskOnBullet) -> bool:
+        """Keep the first finished job of a speculatively executed task and delete the other.
+
+        Returns False if no job has exited yet, i.e. the winner cannot be decided, or if pods of the deleted job are still terminating.
+        Downstream tasks must not read the output until then, since the deleted job may be writing it.
+        """
+        task_id = task.make_unique_id()
+        if task_id in self.task_id_to_terminating_job_name:
+            if not self._is_job_terminated(self.task_id_to_terminating_job_name[task_id]):
+                return False
+            del self.task_id_to_terminating_job_name[task_id]
+            return True
+        if task_id not in self.task_id_to_speculative_job_name:
+            return True
+        job_names = [self.task_id_to_job_name[task_id], self.task_id_to_speculative_job_name[task_id]]
+        job_statuses = [self._get_job_status(job_name, task_completed=True) for job_name in job_names]
+        if JobStatus.SUCCEEDED in job_statuses:
+            winner_job_name = job_names[job_statuses.index(JobStatus.SUCCEEDED)]
+        elif JobStatus.RUNNING in job_statuses:
+            return False
+        else:
+            # both jobs have failed after dumping the output, so let downstream tasks report the failure
+            winner_job_name = job_names[0]
+        for job_name, job_status in zip(job_names, job_statuses):
+            if job_name == winner_job_name:
+                continue
+            if job_status == JobStatus.RUNNING:
+                self._delete_job(job_name, wait_pods=True)
+                self.task_id_to_terminating_job_name[task_id] = job_name
+                logger.info(f"Deleted child job {job_name} because job {winner_job_name} has finished task {self._gen_task_info(task)} first.")
+        self.task_id_to_job_name[task_id] = winner_job_name
+        del self.task_id_to_speculative_job_name[task_id]
+        return self._resolve_speculative_jobs(task)
+
+    def _is_job_terminated(self, job_name: str) -> bool:
+        """Whether all processes of the deleted job have exited."""
+        if self.executor is not None:
+            # a running process cannot be interrupted by executors, so wait for it to exit
+            return self.executor.get_status(job_name) != JobStatus.RUNNING
+        # the job deleted with foreground propagation is kept until all of its pods are deleted
+        assert self.api_instance is not None and self.namespace is not None
+        return not job_exists(self.api_instance, job_name, self.namespace)
+
+    @staticmethod
+    def _has_single_file_outputs(task: TaskOnBullet) -> bool:
+        # outputs of duplicated jobs can be mixed up if a target consists of multiple files, e.g. large data frame targets
+        return all(isinstance(target, SingleFileTarget) for target in flatten(task.output()))
+
+    def _cleanup_child_job(self, task: TaskOnBullet) -> bool:
+        """Delete the child job of a completed task once the job is observed as succeeded.
+
+        Returns False if the job has not exited yet.
+        """
+        if not self.delete_succeeded_jobs:
+            return True
+        job_name = self.task_id_to_job_name[task.make_unique_id()]
+        job_status = self._get_job_status(job_name, task_completed=True)
+        if job_status == JobStatus.RUNNING:
+            return False
+        # failed jobs are kept to be investigated
+        if job_status == JobStatus.SUCCEEDED:
+            self._delete_job(job_name)
+            logger.info(f"Deleted succeeded child job {job_name} of task {self._gen_task_info(task)}.")
+        return True
+
+    def _cancel_running_child_jobs(self) -> None:
+        """Delete all child jobs which are not observed as finished. Errors are logged not to hide the original one."""
+        job_names = list(self.task_id_to_job_name.values()) + list(self.task_id_to_speculative_job_name.values())
+        for job_name in job_names:
+            if job_name in self.job_name_to_final_status:
+                continue
+            try:
+                if self._get_job_status(job_name) != JobStatus.RUNNING:
+                    continue
+                self._delete_job(job_name)
+                logger.info(f"Cancelled child job {job_name}.")
+            except Exception:
+                logger.exception(f"Failed to cancel child job {job_name}.")
+
+    def _get_job_status(self, job_name: str, task_completed: bool = False) -> JobStatus:
+        """Status of the child job. If the task of the job is completed, the job deleted before its final status is observed is regarded as succeeded."""
+        # final status is cached since finished jobs can be deleted afterwards
+        if job_name in self.job_name_to_final_status:
+            return self.job_name_to_final_status[job_name]
+        if self.executor is not None:
+            job_status = self.executor.get_status(job_name)
+        else:
+            assert self.api_instance is not None and self.namespace is not None
+            try:
+                job_status = get_job_status(self.api_instance, job_name, self.namespace)
+            except ApiException as e:
+                # finished jobs are deleted by ttlSecondsAfterFinished
+                if e.status != 404 or not task_completed:
+                    raise
+                logger.info(f"Child job {job_name} of the completed task has been deleted. Regard it as succeeded.")
+                job_status = JobStatus.SUCCEEDED
+        if job_status != JobStatus.RUNNING:
+            self.job_name_to_final_status[job_name] = job_status
+            self._stop_log_stream(job_name)
+        return job_status
+
+    def _submit_child_job(
+        self,
+        job_name: str,
+        task_pkl_path: str,
+        remote_config_path: str | None,
+        anti_affinity_job_name: str | None = None,
+        profile_modes: list[str] | None = None,
+        preferred_node_name: str | None = None,
+    ) -> None:
+        if self.executor is not None:
+            self.executor.submit(job_name, task_pkl_path, remote_config_path, profile_modes=profile_modes)
+            return
         job = self._create_child_job_object(
             job_name=job_name,
-            task_pkl_path=pkl_path,
+            task_pkl_path=task_pkl_path,
             remote_config_path=remote_config_path,
+            anti_affinity_job_name=anti_affinity_job_name,
+            profile_modes=profile_modes,
+            preferred_node_name=preferred_node_name,
         )
+        assert self.api_instance is not None and self.namespace is not None
         create_job(self.api_instance, job, self.namespace)
-        logger.info(f"Created child job {job_name} with task {self._gen_task_info(task)}")
-        self.task_id_to_job_name[task.make_unique_id()] = job_name
+
+    def _delete_job(self, job_name: str, wait_pods: bool = False) -> None:
+        self._stop_log_stream(job_name)
+        if self.executor is not None:
+            self.executor.cancel(job_name)
+            return
+        assert self.api_instance is not None and self.namespace is not None
+        delete_job(self.api_instance, job_name, self.namespace, propagation_policy="Foreground" if wait_pods else "Background")
+
+    def _decide_placement(self, task: TaskOnBullet) -> Literal["child", "master"]:
+        """Run TaskOnBullet on master job if it is expected to finish faster than the startup of a child job."""
+        if self.inline_runtime_threshold_sec is None:
+            return "child"
+        # placement is decided only once, since the task may wait for max_child_jobs
+        if task.make_unique_id() in self.task_id_to_placement:
+            return self.task_id_to_placement[task.make_unique_id()]
+        expected_runtime = self._get_expected_runtime(task)
+        placement: Literal["child", "master"] = "child"
+        if expected_runtime is not None and expected_runtime <= self.inline_runtime_threshold_sec:
+            placement = "master"
+        self.task_id_to_placement[task.make_unique_id()] = placement
+        with self._placement_lock:
+            self.placement_counts[placement] += 1
+        expected_runtime_info = "unknown" if expected_runtime is None else f"{expected_runtime:.1f}s"
+        logger.info(f"Task {self._gen_task_info(task)} is placed on {placement} job. "
+                    f"expected_runtime={expected_runtime_info}, threshold={self.inline_runtime_threshold_sec:.1f}s")
+        return placement
+
+    def _get_expected_runtime(self, task: TaskOnBullet) -> float | None:
+        # wall time in stats store is reported by the child runner, so it doesn't include the startup of child jobs
+        if self.stats_store is not None:
+            wall_time = self.stats_store.get_aggregate(task.get_task_family(), "wall_time")
+            if wall_time is not None:
+                return wall_time["p50"]
+        wall_times = self.task_family_to_wall_times.get(task.get_task_family())
+        if not wall_times:
+            return None
+        return percentile(wall_times, 50)
+
+    def _record_node_locality(self, task: TaskOnBullet) -> bool:
+        """Record the node which ran the task and the size of its cached outputs, reported by the child job.
+
+        Returns False if the report is not written yet while the job is running.
+        """
+        if self.node_local_cache_dir is None:
+            return True
+        report_target = make_target(gen_report_path(self._gen_pkl_path(task)))
+        if not report_target.exists():
+            # the report is written after the outputs, so wait for the child job to exit
+            return self._get_job_status(self.task_id_to_job_name[task.make_unique_id()], task_completed=True) != JobStatus.RUNNING
+        report = report_target.load()
+        if report.get("node_name"):
+            self.task_id_to_node_locality[task.make_unique_id()] = (report["node_name"], report.get("output_size") or 0)
+        return True
+
+    def _get_preferred_node_name(self, task: TaskOnBullet) -> str | None:
+        """Node where the largest input of the task has been cached, if any."""
+        localities = [
+            self.task_id_to_node_locality[child.make_unique_id()] for child in flatten(task.requires())
+            if child.make_unique_id() in self.task_id_to_node_locality
+        ]
+        if not localities:
+            return None
+        node_name, _ = max(localities, key=lambda locality: locality[1])
+        return node_name
+
+    def _start_log_stream(self, task: TaskOnBullet, job_name: str) -> None:
+        if self.log_streamer is not None:
+            self.log_streamer.start(job_name, self._gen_task_info(task))
+
+    def _stop_log_stream(self, job_name: str) -> None:
+        # not to hold a slot of max_log_streams for pods which never start
+        if self.log_streamer is not None:
+            self.log_streamer.stop(job_name)
+
+    def _log_running_summary(self, running_task_ids: Collection[str]) -> None:
+        """Log the number and the progress of tasks running on child jobs at most once per `progress_log_interval_sec`."""
+        now = time()
+        if not running_task_ids or now - self.running_summary_logged_at < self.progress_log_interval_sec:
+            return
+        self.running_summary_logged_at = now
+        message = f"{len(running_task_ids)} tasks are running on child jobs."
+        if self.log_streamer is not None:
+            job_names = [self.task_id_to_job_name[task_id] for task_id in running_task_ids if task_id in self.task_id_to_job_name]
+            progresses = [
+                f"{self.log_streamer.job_name_to_task_info[job_name]}: {self.log_streamer.job_name_to_progress[job_name]}" for job_name in job_names
+                if job_name in self.log_streamer.job_name_to_progress
+            ]
+            if progresses:
+                message += f" Progress: {', '.join(progresses)}"
+        logger.info(message)
+
+    def _get_profile_modes(self, task: TaskOnBullet) -> list[str]:
+        return self.profiling.get(task.get_task_family(), [])
+
+    def _collect_profiles(self) -> None:
+        """Save the index of profiles written by child jobs to `<workspace>/kannon/profile_index.pkl`."""
+        assert self.workspace_dir is not None
+        self.profile_index = []
+        deadline = time() + PROFILE_WAIT_TIMEOUT_SEC
+        for task_id, task in self.task_id_to_profiled_task.items():
+            profile_path = gen_profile_path(self._gen_pkl_path(task))
+            # the profile is dumped after the outputs, so wait for the child job to exit
+            job_name = self.task_id_to_job_name[task_id]
+            while not make_target(profile_path).exists() and time() < deadline and self._get_job_status(job_name, task_completed=True) == JobStatus.RUNNING:
+                sleep(1.0)
+            if not make_target(profile_path).exists():
+                logger.warning(f"Profile of task {self._gen_task_info(task)} is not found. Child script may not use `kannon.child.run_task_on_bullet`.")
+                continue
+            self.profile_index.append(dict(task_family=task.get_task_family(), task_id=task_id, profile_path=profile_path))
+        index_path = os.path.join(self.workspace_dir, "kannon", "profile_index.pkl")
+        make_target(index_path).dump(self.profile_index)
+        logger.info(f"Collected {len(self.profile_index)} profiles of tasks on child jobs into {index_path}.")
+
+    def _record_runtime(self, task: TaskOnBullet) -> bool:
+        """Record the runtime of the task on child job, and the metrics reported by the child job if needed.
+
+        Returns False if the report is not written yet while the job is running.
+        """
+        task_id = task.make_unique_id()
+        if task_id not in self.task_id_to_launched_at:
+            return True
+        report = None
+        if self._reads_runtime_report():
+            report_target = make_target(gen_report_path(self._gen_pkl_path(task)))
+            if report_target.exists():
+                report = report_target.load()
+            elif self._get_job_status(self.task_id_to_job_name[task_id], task_completed=True) == JobStatus.RUNNING:
+                # the report is written after the outputs, so wait for the child job to exit
+                return False
+        launched_at = self.task_id_to_launched_at[task_id]
+        self.task_family_to_child_runtimes.setdefault(task.get_task_family(), []).append(time() - launched_at)
+        if not self._reads_runtime_report():
+            return True
+        metrics = dict(queue_wait=launched_at - self.task_id_to_ready_at.get(task_id, launched_at))
+        if report is not None:
+            # wall time reported by the child runner doesn't include the startup of child jobs
+            wall_time = report["finished_at"] - report["started_at"]
+            self.task_family_to_wall_times.setdefault(task.get_task_family(), []).append(wall_time)
+            metrics.update(
+                wall_time=wall_time,
+                pod_start_latency=report["started_at"] - launched_at,
+                peak_rss=report["peak_rss"],
+            )
+        else:
+            logger.debug(f"Report of task {self._gen_task_info(task)} is not found. Child script may not use `kannon.child.run_task_on_bullet`.")
+        if self.stats_store is not None:
+            self.stats_store.record(task.get_task_family(), **metrics)
+        return True
+
+    def _reads_runtime_report(self) -> bool:
+        # the report is needed only for placement and stats
+        return self.stats_store is not None or self.inline_runtime_threshold_sec is not None
 
     def _create_child_job_object(
         self,
         job_name: str,
         task_pkl_path: str,
         remote_config_path: str | None = None,
-    ) -> client.V1Job:
+        anti_affinity_job_name: str | None = None,
+        profile_modes: list[str] | None = None,
+        preferred_node_name: str | None = None,
+    ) -> dict[str, Any]:
         # TODO: use python -c to avoid dependency to execute_task.py
         cmd = [
             "python",
@@ -185,37 +732,94 @@ class Kannon:
         if remote_config_path:
             cmd.append("--remote-config-path")
             cmd.append(remote_config_path)
-        job = deepcopy(self.template_job)
+        assert self._template_job_body is not None, "template_job is required to create child jobs."
+        # copy only the objects on the path to patched fields, and share the others with the template
+        job = dict(self._template_job_body)
+        job["metadata"] = metadata = dict(job.get("metadata") or {})
+        job["spec"] = spec = dict(job["spec"])
+        spec["template"] = pod_template = dict(spec["template"])
+        pod_template["spec"] = pod_spec = dict(pod_template["spec"])
+        pod_template["metadata"] = pod_metadata = dict(pod_template.get("metadata") or {})
+        pod_metadata["labels"] = {**(pod_metadata.get("labels") or {}), BUILD_ID_LABEL: self.build_id}
+        pod_spec["containers"] = containers = list(pod_spec["containers"])
+        containers[0] = container = dict(containers[0])
         # replace command
-        assert job.spec.template.spec.containers[0].command is None, \
+        assert container.get("command") is None, \
             "command will be replaced by kannon, so you shouldn't set any command and args"
-        job.spec.template.spec.containers[0].command = cmd
+        container["command"] = cmd
         # replace env
-        child_envs = job.spec.template.spec.containers[0].env
-        if not child_envs:
-            child_envs = []
+        child_envs = list(container.get("env") or [])
         if self.env_to_inherit:
             for env_name in self.env_to_inherit:
                 if env_name not in os.environ:
                     raise ValueError(f"Envvar {env_name} does not exist.")
                 child_envs.append({"name": env_name, "value": os.environ.get(env_name)})
-        job.spec.template.spec.containers[0].env = child_envs
+        if profile_modes:
+            child_envs.append({"name": PROFILE_MODES_ENV, "value": ",".join(profile_modes)})
+        if self.node_local_cache_dir:
+            child_envs.append({"name": NODE_NAME_ENV, "valueFrom": {"fieldRef": {"fieldPath": "spec.nodeName"}}})
+            child_envs.append({"name": NODE_LOCAL_CACHE_DIR_ENV, "value": self.node_local_cache_dir})
+            if self.node_local_cache_max_bytes is not None:
+                child_envs.append({"name": NODE_LOCAL_CACHE_MAX_BYTES_ENV, "value": str(self.node_local_cache_max_bytes)})
+            # mount the cache directory of the node at the same path
+            cache_volume_name = "kannon-node-local-cache"
+            pod_spec["volumes"] = list(pod_spec.get("volumes") or []) + [{
+                "name": cache_volume_name,
+                "hostPath": {
+                    "path": self.node_local_cache_dir,
+                    "type": "DirectoryOrCreate"
+                },
+            }]
+            container["volumeMounts"] = list(container.get("volumeMounts") or []) + [{"name": cache_volume_name, "mountPath": self.node_local_cache_dir}]
+        container["env"] = child_envs
         # replace job name
-        job.metadata.name = job_name
+        metadata["name"] = job_name
+        # let the job controller garbage-collect finished jobs
+        if self.ttl_seconds_after_finished is not None:
+            spec["ttlSecondsAfterFinished"] = self.ttl_seconds_after_finished
         # add owner reference from child to parent if master pod info is available
         if self.master_pod_name and self.master_pod_uid:
-            owner_reference = client.V1OwnerReference(
-                api_version="batch/v1",
-                kind="Pod",
-                name=self.master_pod_name,  # owner pod name
-                uid=self.master_pod_uid,  # owner pod uid
-            )
-            if job.metadata.owner_references:
-                job.metadata.owner_references.append(owner_reference)
-            else:
-                job.metadata.owner_references = [owner_reference]
+            owner_reference = {
+                "apiVersion": "batch/v1",
+                "kind": "Pod",
+                "name": self.master_pod_name,  # owner pod name
+                "uid": self.master_pod_uid,  # owner pod uid
+            }
+            metadata["ownerReferences"] = list(metadata.get("ownerReferences") or []) + [owner_reference]
         else:
             logger.warning("Owner reference is not set because master pod info is not provided.")
+            # child jobs are not garbage-collected with the master pod, so let the job controller delete them
+            spec.setdefault("ttlSecondsAfterFinished", DEFAULT_TTL_SECONDS_AFTER_FINISHED)
+        # avoid the node where the pod of given job is running
+        if anti_affinity_job_name:
+            anti_affinity_term = {
+                "labelSelector": {
+                    "matchLabels": {
+                        "job-name": anti_affinity_job_name
+                    }
+                },
+                "topologyKey": "kubernetes.io/hostname",
+            }
+            pod_spec["affinity"] = affinity = dict(pod_spec.get("affinity") or {})
+            affinity["podAntiAffinity"] = pod_anti_affinity = dict(affinity.get("podAntiAffinity") or {})
+            pod_anti_affinity["requiredDuringSchedulingIgnoredDuringExecution"] = \
+                list(pod_anti_affinity.get("requiredDuringSchedulingIgnoredDuringExecution") or []) + [anti_affinity_term]
+        # prefer the node where the largest input has been cached
+        if preferred_node_name:
+            node_affinity_term = {
+                "weight": 100,
+                "preference": {
+                    "matchFields": [{
+                        "key": "metadata.name",
+                        "operator": "In",
+                        "values": [preferred_node_name]
+                    }]
+                },
+            }
+            pod_spec["affinity"] = affinity = dict(pod_spec.get("affinity") or {})
+            affinity["nodeAffinity"] = node_affinity = dict(affinity.get("nodeAffinity") or {})
+            node_affinity["preferredDuringSchedulingIgnoredDuringExecution"] = \
+                list(node_affinity.get("preferredDuringSchedulingIgnoredDuringExecution") or []) + [node_affinity_term]
 
         return job
 
@@ -230,14 +834,66 @@ class Kannon:
     def _check_child_task_status(self, task: TaskOnBullet) -> None:
         if task.make_unique_id() not in self.task_id_to_job_name:
             raise ValueError(f"Task {self._gen_task_info(task)} is not found in `task_id_to_job_name`")
-        job_name = self.task_id_to_job_name[task.make_unique_id()]
-        job_status = get_job_status(
-            self.api_instance,
-            job_name,
-            self.namespace,
-        )
-        if job_status == JobStatus.FAILED:
-            raise RuntimeError(f"Task {self._gen_task_info(task)} on job {job_name} has failed.")
+        job_names = [self.task_id_to_job_name[task.make_unique_id()]]
+        if task.make_unique_id() in self.task_id_to_speculative_job_name:
+            job_names.append(self.task_id_to_speculative_job_name[task.make_unique_id()])
+        job_statuses = [self._get_job_status(job_name) for job_name in job_names]
+        # a task is failed only if all of its original and speculative jobs have failed
+        if all(job_status == JobStatus.FAILED for job_status in job_statuses):
+            raise RuntimeError(f"Task {self._gen_task_info(task)} on job {', '.join(job_names)} has failed.")
+        for job_name, job_status in zip(job_names, job_statuses):
+            if job_status == JobStatus.RUNNING:
+                self._check_stuck_child_job(task, job_name)
+
+    def _check_stuck_child_job(self, task: TaskOnBullet, job_name: str) -> None:
+        """Fail or reschedule the child job if its pods are stuck longer than `stuck_child_timeout_sec`."""
+        if self.core_api_instance is None or self.executor is not None:
+            return
+        reason = get_stuck_pod_reason(self._get_child_pods(job_name))
+        if reason is None:
+            self.job_name_to_stuck_since.pop(job_name, None)
+            return
+        if job_name not in self.job_name_to_stuck_since:
+            logger.warning(f"Child job {job_name} of task {self._gen_task_info(task)} is stuck. reason={reason}")
+            self.job_name_to_stuck_since[job_name] = time()
+        stuck_duration = time() - self.job_name_to_stuck_since[job_name]
+        if stuck_duration < self.stuck_child_timeout_sec:
+            return
+
+        task_id = task.make_unique_id()
+        self._delete_job(job_name)
+        self.job_name_to_final_status[job_name] = JobStatus.FAILED
+        if self.task_id_to_speculative_job_name.get(task_id) == job_name:
+            # the original job is still running, so just give up the duplicate
+            del self.task_id_to_speculative_job_name[task_id]
+            logger.warning(f"Deleted speculative child job {job_name} of task {self._gen_task_info(task)} stuck for {stuck_duration:.0f}s.")
+            return
+        reschedule_count = self.task_id_to_reschedule_count.get(task_id, 0)
+        if self.stuck_child_policy == "reschedule" and reschedule_count < self.max_child_reschedules:
+            new_job_name = gen_job_name(self.job_prefix)
+            self._submit_child_job(new_job_name, self._gen_pkl_path(task), self.remote_config_path, profile_modes=self._get_profile_modes(task))
+            self.task_id_to_job_name[task_id] = new_job_name
+            # the stuck period must not be counted in the runtime, nor make the new job a straggler
+            self.task_id_to_launched_at[task_id] = time()
+            self._start_log_stream(task, new_job_name)
+            self.task_id_to_reschedule_count[task_id] = reschedule_count + 1
+            logger.warning(f"Rescheduled task {self._gen_task_info(task)} on child job {new_job_name} "
+                           f"because job {job_name} was stuck for {stuck_duration:.0f}s. reason={reason}")
+            return
+        raise RuntimeError(f"Task {self._gen_task_info(task)} on job {job_name} has been stuck for {stuck_duration:.0f}s. reason={reason}")
+
+    def _get_child_pods(self, job_name: str, listed_after: float = 0.0) -> list[client.V1Pod]:
+        """Pods of the child job, which are listed for all child jobs of the build at once per `POD_LIST_INTERVAL_SEC`.
+
+        Pods are listed again if the last list is older than `listed_after`.
+        """
+        assert self.core_api_instance is not None and self.namespace is not None
+        with self._pod_list_lock:
+            now = time()
+            if now - self.pods_listed_at >= POD_LIST_INTERVAL_SEC or self.pods_listed_at < listed_after:
+                self.job_name_to_pods = list_pods_by_job_name(self.core_api_instance, self.namespace, f"{BUILD_ID_LABEL}={self.build_id}")
+                self.pods_listed_at = now
+            return self.job_name_to_pods.get(job_name, [])
 
     def _is_executable(self, task: gokart.TaskOnKart) -> bool:
         children = flatten(task.requires())
@@ -245,14 +901,13 @@ class Kannon:
         for child in children:
             if not child.complete():
                 return False
+            # duplicated jobs may be still writing the output
+            if child.make_unique_id() in self.task_id_to_speculative_job_name or child.make_unique_id() in self.task_id_to_terminating_job_name:
+                return False
             if child.make_unique_id() not in self.task_id_to_job_name:
                 continue
             job_name = self.task_id_to_job_name[child.make_unique_id()]
-            job_status = get_job_status(
-                self.api_instance,
-                job_name,
-                self.namespace,
-            )
+            job_status = self._get_job_status(job_name, task_completed=True)
             if job_status == JobStatus.FAILED:
                 raise RuntimeError(f"Task {self._gen_task_info(child)} on job {job_name} has failed.")
             if job_status == JobStatus.RUNNING:
@@ -0,0 +1,112 @@
+""" Node-local cache of task outputs, shared by child jobs running on the same node. """
+from __future__ import annotations
+
+import logging
+import os
+from time import time
+from typing import Any, Callable
+
+import gokart
+from gokart.target import TargetOnKart, make_target
+from luigi.task import flatten
+
+logger = logging.getLogger(__name__)
+
+# Envvars set by the master to child jobs.
+NODE_NAME_ENV = "KANNON_NODE_NAME"
+NODE_LOCAL_CACHE_DIR_ENV = "KANNON_NODE_LOCAL_CACHE_DIR"
+NODE_LOCAL_CACHE_MAX_BYTES_ENV = "KANNON_NODE_LOCAL_CACHE_MAX_BYTES"
+
+
+def gen_node_local_cache_path(cache_dir: str, target_path: str) -> str:
+    """Mirror the path of a target under the cache directory, e.g. gs://bucket/a.pkl -> <cache_dir>/gs/bucket/a.pkl"""
+    return os.path.join(cache_dir, target_path.replace("://", "/").lstrip("/"))
+
+
+def use_node_local_cache(task: gokart.TaskOnKart, cache_dir: str, max_bytes: int | None = None) -> None:
+    """Let the task read its inputs from the node-local cache if available, and write its outputs through to the cache.
+
+    Outputs in the shared workspace are always the source of truth. A cached file is used only if it is newer than the original one.
+    If `max_bytes` is given, least recently used files are evicted after each write so that the cache fits in it.
+    """
+    original_input = task.input
+    original_output = task.output
+    task.input = lambda: _map_targets(lambda target: _wrap_target(target, cache_dir, max_bytes), original_input())  # type: ignore
+    task.output = lambda: _map_targets(lambda target: _wrap_target(target, cache_dir, max_bytes), original_output())  # type: ignore
+
+
+def get_cached_output_size(task: gokart.TaskOnKart, cache_dir: str) -> int:
+    """Total size of the outputs of the task written to the node-local cache."""
+    cache_paths = [gen_node_local_cache_path(cache_dir, target.path()) for target in flatten(task.output())]
+    return sum(os.path.getsize(cache_path) for cache_path in cache_paths if os.path.exists(cache_path))
+
+
+def evict_node_local_cache(cache_dir: str, max_bytes: int) -> None:
+    """Remove least recently used files in the cache directory until their total size fits in `max_bytes`."""
+    files = []
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # the cache is shared by child jobs on the same node, which may evict it concurrently
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            logger.info(f"Evicted {path} from node-local cache.")
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def _touch(path: str) -> None:
+    # access time is set explicitly to track recently used files, since the volume may be mounted with noatime
+    os.utime(path, (time(), os.path.getmtime(path)))
+
+
+def _map_targets(func: Callable[[Any], Any], targets: Any) -> Any:
+    if isinstance(targets, dict):
+        return {key: _map_targets(func, value) for key, value in targets.items()}
+    if isinstance(targets, (list, tuple)):
+        return type(targets)(_map_targets(func, value) for value in targets)
+    return func(targets)
+
+
+def _wrap_target(target: TargetOnKart, cache_dir: str, max_bytes: int | None) -> TargetOnKart:
+    # only single file targets are cached, since the cache is written with the same file processor
+    processor = getattr(target, "_processor", None)
+    if processor is None:
+        return target
+    cache_target = make_target(gen_node_local_cache_path(cache_dir, target.path()), processor=processor)
+    original_load = target.load
+    original_dump = target.dump
+
+    def load() -> Any:
+        try:
+            cache_path = cache_target.path()
+            if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= target.last_modification_time().timestamp():
+                logger.info(f"Loading {target.path()} from node-local cache {cache_path}.")
+                _touch(cache_path)
+                return cache_target.load()
+        except Exception:
+            logger.warning(f"Failed to load {target.path()} from node-local cache.", exc_info=True)
+        return original_load()
+
+    def dump(obj: Any, *args: Any, **kwargs: Any) -> None:
+        original_dump(obj, *args, **kwargs)
+        try:
+            cache_target.dump(obj, lock_at_dump=False)
+            if max_bytes is not None:
+                evict_node_local_cache(cache_dir, max_bytes)
+        except Exception:
+            logger.warning(f"Failed to write {target.path()} to node-local cache.", exc_info=True)
+
+    target.load = load  # type: ignore
+    target.dump = dump  # type: ignore
+    return target
@@ -0,0 +1,140 @@
+""" Profiling of tasks executed on child jobs. """
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import os
+import pstats
+import resource
+import threading
+import tracemalloc
+from time import time
+from typing import Any, Iterator
+
+PROFILE_MODES = ("cprofile", "tracemalloc", "rss")
+# Envvar to pass profile modes from the master to child jobs, e.g. "cprofile,rss".
+PROFILE_MODES_ENV = "KANNON_PROFILE_MODES"
+
+TRACEMALLOC_TOP_N = 50
+RSS_SAMPLING_INTERVAL_SEC = 0.5
+
+
+def validate_profile_modes(profile_modes: list[str]) -> None:
+    for mode in profile_modes:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode}. Supported modes are {PROFILE_MODES}.")
+
+
+def gen_profile_path(task_pkl_path: str) -> str:
+    """Path of the profile which is saved next to the task pickle."""
+    return f"{os.path.splitext(task_pkl_path)[0]}_profile.pkl"
+
+
+@contextlib.contextmanager
+def profile_execution(profile_modes: list[str]) -> Iterator[dict[str, Any]]:
+    """Profile the execution within the context, and put results into the yielded dict on exit.
+
+    - cprofile: raw stats of cProfile, which can be loaded by `load_cprofile_stats`.
+    - tracemalloc: peak traced memory and top allocations by line.
+    - rss: samples of (elapsed seconds, RSS bytes).
+    """
+    validate_profile_modes(profile_modes)
+    result: dict[str, Any] = dict(profile_modes=list(profile_modes))
+    profiler = cProfile.Profile() if "cprofile" in profile_modes else None
+    rss_sampler = _RssSampler() if "rss" in profile_modes else None
+    if "tracemalloc" in profile_modes:
+        tracemalloc.start()
+    if rss_sampler is not None:
+        rss_sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.create_stats()
+            result["cprofile"] = profiler.stats
+        if rss_sampler is not None:
+            result["rss"] = rss_sampler.stop()
+        if "tracemalloc" in profile_modes:
+            snapshot = tracemalloc.take_snapshot()
+            result["tracemalloc"] = dict(
+                peak=tracemalloc.get_traced_memory()[1],
+                top_allocations=[(str(stat.traceback), stat.size, stat.count) for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_N]],
+            )
+            tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def measure_peak_rss() -> Iterator[dict[str, Any]]:
+    """Sample RSS within the context, and put the peak bytes into the yielded dict as "peak_rss" on exit.
+
+    Unlike `ru_maxrss`, which is the peak over the lifetime of the process, this is accurate on reused worker processes.
+    `ru_maxrss` is used instead only if RSS is not available.
+    """
+    result: dict[str, Any] = dict()
+    rss_sampler = _RssSampler()
+    rss_sampler.start()
+    try:
+        yield result
+    finally:
+        samples = rss_sampler.stop()
+        if samples:
+            result["peak_rss"] = max(rss for _, rss in samples)
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            result["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_cprofile_stats(profile: dict[str, Any]) -> pstats.Stats:
+    """Create `pstats.Stats` from a profile saved by the child, e.g. `load_cprofile_stats(profile).sort_stats("cumtime").print_stats(20)`."""
+    return pstats.Stats(_RawStats(profile["cprofile"]))
+
+
+class _RawStats(cProfile.Profile):
+    """Profiler which holds raw stats loaded from a profile, to be accepted by `pstats.Stats`."""
+
+    def __init__(self, stats: dict[Any, Any]) -> None:
+        super().__init__()
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class _RssSampler:
+
+    def __init__(self) -> None:
+        self._samples: list[tuple[float, int]] = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._started_at = time()
+        self._thread.start()
+
+    def stop(self) -> list[tuple[float, int]]:
+        self._stop_event.set()
+        self._thread.join()
+        return self._samples
+
+    def _run(self) -> None:
+        stopped = False
+        while True:
+            rss = _get_rss()
+            if rss is not None:
+                self._samples.append((time() - self._started_at, rss))
+            # take the last sample on stop, since memory usage tends to be the highest at the end
+            if stopped:
+                return
+            stopped = self._stop_event.wait(RSS_SAMPLING_INTERVAL_SEC)
+
+
+def _get_rss() -> int | None:
+    # RSS is available only on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Dict, List
+
+from gokart.target import make_target
+
+from .util import percentile
+
+logger = logging.getLogger(__name__)
+
+# Metrics recorded for each task family.
+# - wall_time: seconds to run a task, reported by the child runner or measured on master job.
+# - queue_wait: seconds from when a task becomes executable to when it is launched.
+# - pod_start_latency: seconds from when a child job is created to when the child runner starts.
+# - peak_rss: peak resident set size of the child runner during the execution of a task in bytes.
+METRICS = ("wall_time", "queue_wait", "pod_start_latency", "peak_rss")
+
+# metric name -> samples
+TaskFamilyStats = Dict[str, List[float]]
+
+
+class TaskStatsStore:
+    """Historical stats of task families persisted across builds.
+
+    Each task family is saved as a pickle file in `stats_dir`, and only the latest `window_size` samples of each metric are kept.
+    Methods are thread-safe, since stats are recorded on threads of AsyncKannon.
+    """
+
+    def __init__(self, stats_dir: str, window_size: int = 100) -> None:
+        if window_size <= 0:
+            raise ValueError(f"window_size must be positive integer, but got {window_size}")
+        self.stats_dir = stats_dir
+        self.window_size = window_size
+        self._task_family_to_stats: dict[str, TaskFamilyStats] = dict()
+        self._dirty_task_families: set[str] = set()
+        self._lock = threading.RLock()
+
+    def record(self, task_family: str, **metrics: float) -> None:
+        for metric in metrics:
+            if metric not in METRICS:
+                raise ValueError(f"Unknown metric {metric}. Supported metrics are {METRICS}.")
+        with self._lock:
+            stats = self._get_stats(task_family)
+            for metric, value in metrics.items():
+                samples = stats.setdefault(metric, [])
+                samples.append(value)
+                del samples[:-self.window_size]
+            self._dirty_task_families.add(task_family)
+
+    def get_samples(self, task_family: str, metric: str) -> list[float]:
+        with self._lock:
+            return list(self._get_stats(task_family).get(metric, []))
+
+    def get_aggregate(self, task_family: str, metric: str) -> dict[str, float] | None:
+        """Rolling aggregates of given metric, or None if no sample is recorded."""
+        samples = self.get_samples(task_family, metric)
+        if not samples:
+            return None
+        return dict(
+            count=len(samples),
+            mean=sum(samples) / len(samples),
+            p50=percentile(samples, 50),
+            p90=percentile(samples, 90),
+            max=max(samples),
+        )
+
+    def flush(self) -> None:
+        """Save stats of task families updated since the last flush."""
+        with self._lock:
+            for task_family in sorted(self._dirty_task_families):
+                make_target(self._gen_stats_path(task_family)).dump(self._task_family_to_stats[task_family])
+            logger.info(f"Saved stats of {len(self._dirty_task_families)} task families to {self.stats_dir}.")
+            self._dirty_task_families.clear()
+
+    def _get_stats(self, task_family: str) -> TaskFamilyStats:
+        # should be called with the lock
+        if task_family not in self._task_family_to_stats:
+            target = make_target(self._gen_stats_path(task_family))
+            self._task_family_to_stats[task_family] = target.load() if target.exists() else dict()
+        return self._task_family_to_stats[task_family]
+
+    def _gen_stats_path(self, task_family: str) -> str:
+        return os.path.join(self.stats_dir, f"{task_family}.pkl")
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+import math
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of given values."""
+    sorted_values = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import unittest
+
+import gokart
+import luigi
+from gokart.target import make_target
+
+from kannon import AsyncKannon, Kannon, LocalProcessExecutor, TaskOnBullet
+from kannon.stats import TaskStatsStore
+
+
+class Source(gokart.TaskOnKart):
+    param = luigi.IntParameter()
+
+    def run(self) -> None:
+        self.dump(self.param)
+
+
+class Square(TaskOnBullet):
+    parent = gokart.TaskInstanceParameter()
+
+    def run(self) -> None:
+        self.dump(self.load("parent")**2)
+
+    def requires(self) -> dict[str, gokart.TaskOnKart]:
+        return dict(parent=self.parent)
+
+
+class Fail(TaskOnBullet):
+
+    def run(self) -> None:
+        raise ValueError("failed on purpose")
+
+
+class Sum(gokart.TaskOnKart):
+    parents = gokart.ListTaskInstanceParameter()
+
+    def run(self) -> None:
+        self.dump(sum(self.load("parents")))
+
+    def requires(self) -> dict[str, list[gokart.TaskOnKart]]:
+        return dict(parents=self.parents)
+
+
+class TestLocalProcessExecutor(unittest.TestCase):
+
+    def test_build(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(3)]
+            root_task = Sum(parents=squares, workspace_directory=workspace_dir)
+
+            with LocalProcessExecutor(max_workers=2) as executor:
+                Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                ).build(root_task)
+
+            self.assertEqual(root_task.output().load(), 0 + 1 + 4)
+            # task objects are handed over via pickle files, and child processes report their executions
+            file_names = os.listdir(os.path.join(workspace_dir, "kannon"))
+            self.assertEqual(len([file_name for file_name in file_names if file_name.endswith("_report.pkl")]), 3)
+            self.assertEqual(len(file_names), 6)
+
+    def test_build_async(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(3)]
+            root_task = Sum(parents=squares, workspace_directory=workspace_dir)
+
+            with LocalProcessExecutor(max_workers=2) as executor:
+                AsyncKannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    max_child_jobs=2,
+                    poll_interval_sec=0.1,
+                ).build(root_task)
+
+            self.assertEqual(root_task.output().load(), 0 + 1 + 4)
+
+    def test_record_stats(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(3)]
+            root_task = Sum(parents=squares, workspace_directory=workspace_dir)
+
+            with LocalProcessExecutor(max_workers=2) as executor:
+                Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    record_stats=True,
+                ).build(root_task)
+
+            store = TaskStatsStore(os.path.join(workspace_dir, "kannon", "stats"))
+            for metric in ["wall_time", "queue_wait", "pod_start_latency", "peak_rss"]:
+                self.assertEqual(len(store.get_samples("Square", metric)), 3)
+            # tasks on master job
+            self.assertEqual(len(store.get_samples("Source", "wall_time")), 3)
+            self.assertEqual(len(store.get_samples("Sum", "wall_time")), 1)
+
+    def test_record_stats_of_root_tasks(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            # the build ends as soon as the outputs of the roots are dumped, before their reports are written
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(4)]
+
+            with LocalProcessExecutor(max_workers=4) as executor:
+                Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    record_stats=True,
+                ).build(squares)
+
+            store = TaskStatsStore(os.path.join(workspace_dir, "kannon", "stats"))
+            for metric in ["wall_time", "queue_wait", "pod_start_latency", "peak_rss"]:
+                self.assertEqual(len(store.get_samples("Square", metric)), 4)
+
+    def test_profiling(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(3)]
+            root_task = Sum(parents=squares, workspace_directory=workspace_dir)
+
+            with LocalProcessExecutor(max_workers=2) as executor:
+                master = Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    profiling={"Square": ["cprofile", "rss"]},
+                )
+                master.build(root_task)
+
+            self.assertEqual(len(master.profile_index), 3)
+            self.assertEqual(make_target(os.path.join(workspace_dir, "kannon", "profile_index.pkl")).load(), master.profile_index)
+            for entry in master.profile_index:
+                self.assertEqual(entry["task_family"], "Square")
+                profile = make_target(entry["profile_path"]).load()
+                self.assertEqual(profile["profile_modes"], ["cprofile", "rss"])
+                self.assertIn("cprofile", profile)
+
+    def test_profiling_root_tasks(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            # the build ends as soon as the outputs of the roots are dumped, before their profiles are written
+            squares = [Square(parent=Source(param=i, workspace_directory=workspace_dir), workspace_directory=workspace_dir) for i in range(4)]
+
+            with LocalProcessExecutor(max_workers=4) as executor:
+                master = Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    profiling={"Square": ["cprofile"]},
+                )
+                with self.assertNoLogs("kannon.master", level="WARNING"):
+                    master.build(squares)
+
+            self.assertEqual(len(master.profile_index), 4)
+
+    def test_build_fail(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            with LocalProcessExecutor(max_workers=1) as executor:
+                master = Kannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                )
+                with self.assertRaises(RuntimeError):
+                    master.build(Fail(workspace_directory=workspace_dir))
+
+    def test_build_async_fail(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            with LocalProcessExecutor(max_workers=1) as executor:
+                master = AsyncKannon(
+                    api_instance=None,
+                    template_job=None,
+                    job_prefix="local",
+                    executor=executor,
+                    poll_interval_sec=0.1,
+                )
+                with self.assertRaises(RuntimeError):
+                    master.build(Fail(workspace_directory=workspace_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,7 @@ import luigi
 from kubernetes import client
 from luigi.task import flatten
 
-from kannon import Kannon, TaskOnBullet
+from kannon import AsyncKannon, Kannon, TaskOnBullet
 
 
 class MockTaskOnKart(gokart.TaskOnKart):
@@ -42,7 +42,7 @@ class MockTaskOnBullet(TaskOnBullet):
 
 class MockKannon(Kannon):
 
-    def __init__(self, *, max_child_jobs: int | None = None) -> None:
+    def __init__(self, *, max_child_jobs: int | None = None, inline_runtime_threshold_sec: float | None = None) -> None:
         super().__init__(
             api_instance=None,
             template_job=client.V1Job(metadata=client.V1ObjectMeta()),
@@ -50,6 +50,7 @@ class MockKannon(Kannon):
             path_child_script=__file__,  # just pass any existing file as dummy
             env_to_inherit=None,
             max_child_jobs=max_child_jobs,
+            inline_runtime_threshold_sec=inline_runtime_threshold_sec,
         )
 
     def _exec_gokart_task(self, task: MockTaskOnKart) -> None:
@@ -70,6 +71,10 @@ class MockKannon(Kannon):
         return True
 
 
+class MockAsyncKannon(MockKannon, AsyncKannon):
+    pass
+
+
 class TestConsumeTaskQueue(unittest.TestCase):
 
     def test_single_task_on_kart(self) -> None:
@@ -120,7 +125,6 @@ class TestConsumeTaskQueue(unittest.TestCase):
             'INFO:kannon.master:Consuming task queue...',
             f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
             f'INFO:kannon.master:Trying to run task {root_task_info} on child job...',
-            f'INFO:kannon.master:Task {root_task_info} is still running on child job.',
             f'INFO:kannon.master:Task {root_task_info} is already completed.',
             'INFO:kannon.master:All tasks completed!',
         ])
@@ -169,9 +173,6 @@ class TestConsumeTaskQueue(unittest.TestCase):
             f'INFO:kannon.master:Checking if task {c3_task_info} is executable...',
             f'INFO:kannon.master:Trying to run task {c3_task_info} on child job...',
             f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
-            f'INFO:kannon.master:Task {c1_task_info} is still running on child job.',
-            f'INFO:kannon.master:Task {c2_task_info} is still running on child job.',
-            f'INFO:kannon.master:Task {c3_task_info} is still running on child job.',
             f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
             f'INFO:kannon.master:Executing task {root_task_info} on master job...',
             f'INFO:kannon.master:Completed task {root_task_info} on master job.',
@@ -227,8 +228,6 @@ class TestConsumeTaskQueue(unittest.TestCase):
                 f'INFO:kannon.master:Checking if task {c3_task_info} is executable...',
                 f'INFO:kannon.master:Reach max_child_jobs, waiting to run task {c3_task_info} on child job...',
                 f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
-                f'INFO:kannon.master:Task {c1_task_info} is still running on child job.',
-                f'INFO:kannon.master:Task {c2_task_info} is still running on child job.',
                 f'INFO:kannon.master:Checking if task {c3_task_info} is executable...',
                 f'INFO:kannon.master:Reach max_child_jobs, waiting to run task {c3_task_info} on child job...',
                 f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
@@ -238,7 +237,6 @@ class TestConsumeTaskQueue(unittest.TestCase):
                 f'INFO:kannon.master:Checking if task {c3_task_info} is executable...',
                 f'INFO:kannon.master:Trying to run task {c3_task_info} on child job...',
                 f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
-                f'INFO:kannon.master:Task {c3_task_info} is still running on child job.',
                 f'INFO:kannon.master:Checking if task {root_task_info} is executable...',
                 f'INFO:kannon.master:Executing task {root_task_info} on master job...',
                 f'INFO:kannon.master:Completed task {root_task_info} on master job.',
@@ -246,6 +244,121 @@ class TestConsumeTaskQueue(unittest.TestCase):
                 'INFO:kannon.master:All tasks completed!',
             ])
 
+    def test_multiple_root_tasks(self) -> None:
+
+        class Child(MockTaskOnBullet):
+            pass
+
+        class Parent(MockTaskOnKart):
+            param = luigi.IntParameter()
+
+            def requires(self) -> Child:
+                return child
+
+        child = Child()
+        p1 = Parent(param=1)
+        p2 = Parent(param=2)
+        p3 = Parent(param=3)
+
+        master = MockKannon()
+        master._exec_bullet_task = MagicMock(side_effect=master._exec_bullet_task)  # type:ignore
+        # root task added before build is scheduled in the same build
+        master.add_root_task(p3)
+        master.build([p1, p2])
+
+        for parent in [p1, p2, p3]:
+            self.assertIsNotNone(parent.started_at)
+        # shared child is executed only once
+        master._exec_bullet_task.assert_called_once()
+
+    def test_inline_placement(self) -> None:
+
+        class Short(MockTaskOnBullet):
+            param = luigi.IntParameter()
+
+        class Long(MockTaskOnBullet):
+            pass
+
+        short0 = Short(param=0)
+        short1 = Short(param=1)
+        long = Long()
+
+        class Parent(MockTaskOnKart):
+
+            def requires(self) -> list[MockTaskOnBullet]:
+                return [short0, short1, long]
+
+        root_task = Parent()
+        master = MockKannon(inline_runtime_threshold_sec=10.0)
+        master.task_family_to_wall_times[short0.get_task_family()] = [1.0, 2.0, 3.0]
+        master.task_family_to_wall_times[long.get_task_family()] = [60.0]
+        with self.assertLogs() as cm:
+            master.build(root_task)
+
+        self.assertIn(f'INFO:kannon.master:Executing task {master._gen_task_info(short0)} on master job...', cm.output)
+        self.assertIn(f'INFO:kannon.master:Executing task {master._gen_task_info(short1)} on master job...', cm.output)
+        self.assertIn(f'INFO:kannon.master:Trying to run task {master._gen_task_info(long)} on child job...', cm.output)
+        self.assertEqual(master.placement_counts, {"master": 2, "child": 1})
+        self.assertIn('INFO:kannon.master:Placement of TaskOnBullet: 1 on child jobs, 2 on master job.', cm.output)
+
+
+class TestAsyncBuild(unittest.TestCase):
+
+    def test_three_task_on_bullet_with_max_child_jobs(self) -> None:
+
+        class Child(MockTaskOnBullet):
+            param = luigi.IntParameter()
+
+        children = [Child(param=i) for i in range(3)]
+
+        class Parent(MockTaskOnKart):
+
+            def requires(self) -> list[Child]:
+                return children
+
+        root_task = Parent()
+
+        master = MockAsyncKannon(max_child_jobs=2)
+        master.build(root_task)
+
+        started_ats = sorted(child.started_at for child in children if child.started_at is not None)
+        self.assertEqual(len(started_ats), 3)
+        # the last child waits until one of the others is completed
+        self.assertGreaterEqual(started_ats[2], started_ats[0] + Child.wait_sec)
+        self.assertGreaterEqual(root_task.started_at, started_ats[2] + Child.wait_sec)
+
+    def test_shared_dependency(self) -> None:
+
+        class Child(MockTaskOnBullet):
+            pass
+
+        class Parent(MockTaskOnKart):
+            param = luigi.IntParameter()
+
+            def requires(self) -> Child:
+                return child
+
+        child = Child()
+        parents = [Parent(param=i) for i in range(3)]
+
+        master = MockAsyncKannon()
+        master._exec_bullet_task = MagicMock(side_effect=master._exec_bullet_task)  # type:ignore
+        master.build(parents)
+
+        for parent in parents:
+            self.assertIsNotNone(parent.started_at)
+        master._exec_bullet_task.assert_called_once()
+
+    def test_restore_shutdown_handler_config(self) -> None:
+        config = luigi.configuration.get_config()
+        self.assertFalse(config.has_option("worker", "no_install_shutdown_handler"))
+
+        master = MockAsyncKannon()
+        master.build(MockTaskOnKart())
+        # luigi workers on the main thread install the signal handler again after the build
+        self.assertFalse(config.has_option("worker", "no_install_shutdown_handler"))
+        self.assertFalse(config.has_option("gokart_worker", "no_install_shutdown_handler"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import luigi
+
+from kannon.child import load_remote_config
+from kannon.config import convert_to_ini, upload_config_bundle
+
+
+class TestConfigBundle(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config_paths = [
+            self._write("base.ini", "[TaskA]\nparam = ${HOME}\nsize = 1\n"),
+            self._write("env.yaml", "TaskA:\n  size: 2\n  flag: true\nTaskB:\n  items: [1, 2]\n"),
+            self._write("experiment.toml", "[TaskB]\nname = 'exp'\n"),
+        ]
+        self.remote_config_dir = os.path.join(self.temp_dir.name, "remote")
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def _write(self, file_name: str, content: str) -> str:
+        path = os.path.join(self.temp_dir.name, file_name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_convert_to_ini(self) -> None:
+        self.assertEqual(convert_to_ini(self.config_paths[0]), "[TaskA]\nparam = ${HOME}\nsize = 1\n")
+        self.assertEqual(convert_to_ini(self.config_paths[1]), "[TaskA]\nsize = 2\nflag = true\n\n[TaskB]\nitems = [1, 2]\n\n")
+        self.assertEqual(convert_to_ini(self.config_paths[2]), "[TaskB]\nname = exp\n\n")
+
+    def test_convert_to_ini_fail(self) -> None:
+        cases = [
+            self._write("conf.json", "{}"),
+            self._write("invalid.yaml", "- TaskA\n"),
+        ]
+        for config_path in cases:
+            with self.subTest(config_path=config_path):
+                with self.assertRaises(ValueError):
+                    convert_to_ini(config_path)
+
+    def test_upload_only_if_changed(self) -> None:
+        remote_config_path = upload_config_bundle(self.config_paths, self.remote_config_dir)
+        with patch("gokart.target.SingleFileTarget.dump") as mock_dump:
+            self.assertEqual(upload_config_bundle(self.config_paths, self.remote_config_dir), remote_config_path)
+        mock_dump.assert_not_called()
+
+        self._write("experiment.toml", "[TaskB]\nname = 'exp2'\n")
+        self.assertNotEqual(upload_config_bundle(self.config_paths, self.remote_config_dir), remote_config_path)
+        self.assertEqual(len(os.listdir(self.remote_config_dir)), 2)
+
+    def test_load_remote_config(self) -> None:
+        remote_config_path = upload_config_bundle(self.config_paths, self.remote_config_dir)
+        config_paths_before = list(luigi.configuration.LuigiConfigParser._config_paths)
+        try:
+            with patch("kannon.child._loaded_remote_config_paths", set()):
+                load_remote_config(remote_config_path)
+                # loaded only once by the same process
+                load_remote_config(remote_config_path)
+            self.assertEqual(len(luigi.configuration.LuigiConfigParser._config_paths), len(config_paths_before) + len(self.config_paths))
+            config = luigi.configuration.get_config()
+            # later config files override earlier ones
+            self.assertEqual(config.get("TaskA", "size"), "2")
+            self.assertEqual(config.get("TaskA", "param"), os.environ["HOME"])
+            self.assertEqual(config.get("TaskB", "items"), "[1, 2]")
+            self.assertEqual(config.get("TaskB", "name"), "exp")
+        finally:
+            luigi.configuration.LuigiConfigParser._config_paths = config_paths_before
+            luigi.configuration.LuigiConfigParser.reload()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from kannon.kube_util import JOB_NAME_MAX_LENGTH, ThrottledApi, TokenBucket, gen_job_name, get_stuck_pod_reason, list_pods_by_job_name
+
+
+def _pod(name: str,
+         phase: str,
+         conditions: list[client.V1PodCondition] | None = None,
+         container_statuses: list[client.V1ContainerStatus] | None = None) -> client.V1Pod:
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(name=name),
+        status=client.V1PodStatus(phase=phase, conditions=conditions, container_statuses=container_statuses),
+    )
+
+
+def _waiting_container_status(reason: str) -> client.V1ContainerStatus:
+    return client.V1ContainerStatus(
+        name="job",
+        image="dummy-image",
+        image_id="",
+        ready=False,
+        restart_count=0,
+        state=client.V1ContainerState(waiting=client.V1ContainerStateWaiting(reason=reason, message="dummy-message")),
+    )
+
+
+UNSCHEDULABLE_POD = _pod(
+    "unschedulable",
+    "Pending",
+    conditions=[client.V1PodCondition(type="PodScheduled", status="False", reason="Unschedulable", message="0/3 nodes are available")],
+)
+IMAGE_PULL_BACK_OFF_POD = _pod("image-pull-back-off", "Pending", container_statuses=[_waiting_container_status("ImagePullBackOff")])
+CONTAINER_CREATING_POD = _pod("container-creating", "Pending", container_statuses=[_waiting_container_status("ContainerCreating")])
+RUNNING_POD = _pod("running", "Running")
+FAILED_POD = _pod("failed", "Failed")
+
+
+class TestGetStuckPodReason(unittest.TestCase):
+
+    def test_get_stuck_pod_reason(self) -> None:
+        cases = [
+            ([UNSCHEDULABLE_POD], "unschedulable: Unschedulable (0/3 nodes are available)"),
+            ([IMAGE_PULL_BACK_OFF_POD], "image-pull-back-off: ImagePullBackOff (dummy-message)"),
+            ([FAILED_POD, IMAGE_PULL_BACK_OFF_POD], "image-pull-back-off: ImagePullBackOff (dummy-message)"),
+            # pods making progress
+            ([CONTAINER_CREATING_POD], None),
+            ([RUNNING_POD], None),
+            ([UNSCHEDULABLE_POD, RUNNING_POD], None),
+            # no active pods
+            ([], None),
+            ([FAILED_POD], None),
+        ]
+        for pods, expected in cases:
+            with self.subTest(pods=[pod.metadata.name for pod in pods]):
+                self.assertEqual(get_stuck_pod_reason(pods), expected)
+
+
+class TestListPodsByJobName(unittest.TestCase):
+
+    def test_list_pods_by_job_name(self) -> None:
+        pod_name_to_job_name = dict([("pod-0", "job-0"), ("pod-1", "job-1"), ("pod-2", "job-0"), ("pod-3", None)])
+        pods = [
+            client.V1Pod(metadata=client.V1ObjectMeta(name=pod_name, labels={"job-name": job_name} if job_name else None))
+            for pod_name, job_name in pod_name_to_job_name.items()
+        ]
+        api_instance = MagicMock()
+        api_instance.list_namespaced_pod.return_value = client.V1PodList(items=pods)
+        job_name_to_pods = list_pods_by_job_name(api_instance, "dummy-namespace", "kannon-build-id=abc")
+        self.assertEqual([pod.metadata.name for pod in job_name_to_pods["job-0"]], ["pod-0", "pod-2"])
+        self.assertEqual([pod.metadata.name for pod in job_name_to_pods["job-1"]], ["pod-1"])
+        self.assertEqual(len(job_name_to_pods), 2)
+        api_instance.list_namespaced_pod.assert_called_once_with(namespace="dummy-namespace", label_selector="kannon-build-id=abc")
+
+
+def _api_exception(status: int, headers: dict[str, str] | None = None) -> ApiException:
+    e = ApiException(status=status)
+    e.headers = headers
+    return e
+
+
+class TestGenJobName(unittest.TestCase):
+
+    def test_gen_job_name(self) -> None:
+        job_names = [gen_job_name("Very_Long_Prefix" * 5) for _ in range(1000)]
+        self.assertEqual(len(set(job_names)), len(job_names))
+        for job_name in job_names:
+            self.assertLessEqual(len(job_name), JOB_NAME_MAX_LENGTH)
+            self.assertTrue(job_name.startswith("very-long-prefix"))
+
+
+class TestThrottledApi(unittest.TestCase):
+
+    def test_retry(self) -> None:
+        api_instance = MagicMock()
+        api_instance.read_namespaced_job_status.side_effect = [_api_exception(429, {"Retry-After": "3"}), _api_exception(503), "ok"]
+        throttled_api = ThrottledApi(api_instance, max_retries=2)
+        with patch("kannon.kube_util.sleep") as mock_sleep:
+            self.assertEqual(throttled_api.read_namespaced_job_status(name="test-job", namespace="dummy-namespace"), "ok")
+        self.assertEqual(api_instance.read_namespaced_job_status.call_count, 3)
+        # Retry-After is respected
+        self.assertGreaterEqual(mock_sleep.call_args_list[0][0][0], 3.0)
+        self.assertEqual(throttled_api.counters["requests"], 3)
+        self.assertEqual(throttled_api.counters["retries"], 2)
+
+    def test_retry_exhausted(self) -> None:
+        api_instance = MagicMock()
+        api_instance.read_namespaced_job_status.side_effect = _api_exception(500)
+        throttled_api = ThrottledApi(api_instance, max_retries=2)
+        with patch("kannon.kube_util.sleep"):
+            with self.assertRaises(ApiException):
+                throttled_api.read_namespaced_job_status(name="test-job", namespace="dummy-namespace")
+        self.assertEqual(api_instance.read_namespaced_job_status.call_count, 3)
+        self.assertEqual(throttled_api.counters["failures"], 1)
+
+    def test_retried_create_conflict(self) -> None:
+        api_instance = MagicMock()
+        # the first request is applied on the server, but its response is lost
+        api_instance.create_namespaced_job.side_effect = [_api_exception(504), _api_exception(409)]
+        throttled_api = ThrottledApi(api_instance, max_retries=2)
+        with patch("kannon.kube_util.sleep"):
+            self.assertIsNone(throttled_api.create_namespaced_job(body={}, namespace="dummy-namespace"))
+        self.assertEqual(api_instance.create_namespaced_job.call_count, 2)
+        self.assertEqual(throttled_api.counters["conflicts"], 1)
+        self.assertEqual(throttled_api.counters["failures"], 0)
+
+        # conflict on the first request is a genuine error
+        api_instance.create_namespaced_job.side_effect = _api_exception(409)
+        with self.assertRaises(ApiException):
+            throttled_api.create_namespaced_job(body={}, namespace="dummy-namespace")
+
+    def test_not_retryable(self) -> None:
+        api_instance = MagicMock()
+        api_instance.read_namespaced_job_status.side_effect = _api_exception(404)
+        throttled_api = ThrottledApi(api_instance)
+        with self.assertRaises(ApiException):
+            throttled_api.read_namespaced_job_status(name="test-job", namespace="dummy-namespace")
+        self.assertEqual(api_instance.read_namespaced_job_status.call_count, 1)
+        self.assertEqual(throttled_api.counters["retries"], 0)
+
+    def test_throttle(self) -> None:
+        api_instance = MagicMock()
+        throttled_api = ThrottledApi(api_instance, qps=10.0, burst=2)
+        with patch("kannon.kube_util.monotonic", return_value=0.0):
+            throttled_api._token_bucket = TokenBucket(qps=10.0, burst=2)
+            with patch("kannon.kube_util.sleep") as mock_sleep:
+                for _ in range(4):
+                    throttled_api.list_namespaced_pod(namespace="dummy-namespace")
+        # first 2 calls are allowed by burst
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.1, 0.2])
+        self.assertEqual(throttled_api.counters["throttled"], 2)
+        self.assertEqual(api_instance.list_namespaced_pod.call_count, 4)
+
+    def test_connection_pool_maxsize(self) -> None:
+        api_instance = client.BatchV1Api(api_client=client.ApiClient())
+        ThrottledApi(api_instance, connection_pool_maxsize=32)
+        self.assertEqual(api_instance.api_client.rest_client.pool_manager.connection_pool_kw["maxsize"], 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
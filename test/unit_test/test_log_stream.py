@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import io
+import threading
+import unittest
+from time import sleep, time
+from unittest.mock import MagicMock, patch
+
+from kubernetes import client
+
+from kannon.log_stream import ChildLogStreamer, parse_progress
+
+
+def _make_pod(name: str, phase: str) -> client.V1Pod:
+    return client.V1Pod(metadata=client.V1ObjectMeta(name=name), status=client.V1PodStatus(phase=phase))
+
+
+class TestParseProgress(unittest.TestCase):
+
+    def test_parse_progress(self) -> None:
+        self.assertEqual(parse_progress("KANNON_PROGRESS 3/10 loading"), "3/10 (30%) loading")
+        self.assertEqual(parse_progress("INFO:root:KANNON_PROGRESS 1/4"), "1/4 (25%)")
+        self.assertEqual(parse_progress("KANNON_PROGRESS 0/0"), "0/0")
+        self.assertIsNone(parse_progress("some log line"))
+
+
+class TestChildLogStreamer(unittest.TestCase):
+
+    def test_stream(self) -> None:
+        core_api_instance = MagicMock()
+        core_api_instance.read_namespaced_pod_log.return_value.stream.return_value = iter([b"hello\nKANNON_PROGRESS 3/10 load", b"ing\npartial"])
+        sink = io.StringIO()
+
+        streamer = ChildLogStreamer(core_api_instance, "dummy-namespace", MagicMock(return_value=[_make_pod("pod-0", "Succeeded")]), sink)
+        streamer.start("job-0", "Example_abc")
+        streamer.close()
+
+        self.assertEqual(sink.getvalue(), "[Example_abc] hello\n[Example_abc] KANNON_PROGRESS 3/10 loading\n[Example_abc] partial\n")
+        self.assertEqual(streamer.job_name_to_progress, {"job-0": "3/10 (30%) loading"})
+        core_api_instance.read_namespaced_pod_log.assert_called_once_with(name="pod-0", namespace="dummy-namespace", follow=True, _preload_content=False)
+
+    def test_max_streams(self) -> None:
+        release_first_stream = threading.Event()
+
+        def stream_first(_: int) -> list[bytes]:
+            release_first_stream.wait()
+            return [b"first\n"]
+
+        first_response, second_response = MagicMock(), MagicMock()
+        first_response.stream.side_effect = stream_first
+        second_response.stream.return_value = [b"second\n"]
+        list_pods = MagicMock(side_effect=lambda job_name, listed_after: [_make_pod(f"pod-{job_name}", "Succeeded")])
+        core_api_instance = MagicMock()
+        core_api_instance.read_namespaced_pod_log.side_effect = lambda name, **kwargs: first_response if name == "pod-0" else second_response
+        sink = io.StringIO()
+
+        streamer = ChildLogStreamer(core_api_instance, "dummy-namespace", list_pods, sink, max_streams=1)
+        streamer.start("0", "First")
+        streamer.start("1", "Second")
+        # the second job waits until the first stream ends
+        self.assertEqual(list_pods.call_count, 1)
+        release_first_stream.set()
+        streamer.close()
+
+        self.assertEqual(sink.getvalue(), "[First] first\n[Second] second\n")
+
+    def test_retried_pods(self) -> None:
+        list_pods = MagicMock(side_effect=[
+            [_make_pod("pod-0", "Running")],
+            # the job controller recreates the failed pod
+            [_make_pod("pod-0", "Failed")],
+            [_make_pod("pod-0", "Failed"), _make_pod("pod-1", "Running")],
+            [_make_pod("pod-0", "Failed"), _make_pod("pod-1", "Succeeded")],
+        ])
+        core_api_instance = MagicMock()
+        core_api_instance.read_namespaced_pod_log.side_effect = lambda name, **kwargs: MagicMock(stream=MagicMock(return_value=[f"{name}\n".encode()]))
+        sink = io.StringIO()
+
+        streamer = ChildLogStreamer(core_api_instance, "dummy-namespace", list_pods, sink)
+        with patch("kannon.log_stream.sleep"):
+            streamer.start("job-0", "Example_abc")
+            streamer.close()
+
+        self.assertEqual(sink.getvalue(), "[Example_abc] pod-0\n[Example_abc] pod-1\n")
+        self.assertEqual(list_pods.call_count, 4)
+        core_api_instance.list_namespaced_pod.assert_not_called()
+
+    def test_stop(self) -> None:
+        core_api_instance = MagicMock()
+        # pod never starts, e.g. the job has been deleted
+        list_pods = MagicMock(return_value=[_make_pod("pod-0", "Pending")])
+        sink = io.StringIO()
+
+        streamer = ChildLogStreamer(core_api_instance, "dummy-namespace", list_pods, sink, max_streams=1)
+        with patch("kannon.log_stream.sleep"):
+            streamer.start("job-0", "Example_abc")
+            with patch("kannon.log_stream.time", return_value=100.0):
+                streamer.stop("job-0")
+            deadline = time() + 5.0
+            while streamer._threads and time() < deadline:
+                sleep(0.01)
+        # the slot is released without closing the streamer
+        self.assertEqual(streamer._threads, {})
+        core_api_instance.read_namespaced_pod_log.assert_not_called()
+        # pods are listed after the job is stopped, not to miss a pod started just before it
+        list_pods.assert_called_with("job-0", 100.0)
+        streamer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
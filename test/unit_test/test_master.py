@@ -1,12 +1,50 @@
 from __future__ import annotations
 
+import io
 import os
+import tempfile
 import unittest
+from typing import Any, Literal
+from unittest.mock import MagicMock, patch
 
 import gokart
+import luigi
+from gokart.target import make_target
 from kubernetes import client
-
-from kannon import Kannon
+from kubernetes.client.rest import ApiException
+
+from kannon import Kannon, TaskOnBullet
+from kannon.child import gen_report_path
+from kannon.kube_util import JobStatus
+from kannon.log_stream import ChildLogStreamer
+from kannon.master import DEFAULT_TTL_SECONDS_AFTER_FINISHED
+
+
+def _get_template_job() -> client.V1Job:
+    return client.V1Job(api_version="batch/v1",
+                        kind="Job",
+                        metadata=client.V1ObjectMeta(
+                            name="dummy-job-name",
+                            namespace="dummy-namespace",
+                        ),
+                        spec=client.V1JobSpec(template=client.V1PodTemplateSpec(spec=client.V1PodSpec(
+                            service_account_name="dummy-service-account",
+                            containers=[client.V1Container(
+                                name="job",
+                                image="dummy-image",
+                            )],
+                            restart_policy="Never",
+                        ))))
+
+
+def _get_master(api_instance: MagicMock, **kwargs: Any) -> Kannon:
+    return Kannon(
+        api_instance=api_instance,
+        template_job=_get_template_job(),
+        job_prefix="dummy",
+        path_child_script=__file__,  # just pass any existing file as dummy
+        **kwargs,
+    )
 
 
 class TestCreateTaskQueue(unittest.TestCase):
@@ -48,24 +86,35 @@ class TestCreateTaskQueue(unittest.TestCase):
                 )
                 master._create_task_queue(case)
 
+    def test_create_task_queue_multiple_roots(self) -> None:
 
-class TestCreateChildJobObject(unittest.TestCase):
+        class Shared(gokart.TaskOnKart):
+            pass
+
+        class Root(gokart.TaskOnKart):
+            param = luigi.IntParameter()
+
+            def requires(self) -> Shared:
+                return Shared()
+
+        master = Kannon(
+            api_instance=None,
+            template_job=client.V1Job(metadata=client.V1ObjectMeta()),
+            job_prefix="",
+            path_child_script=__file__,  # just pass any existing file as dummy
+        )
+        task_queue = master._create_task_queue([Root(param=0), Root(param=1), Root(param=0)])
+        self.assertEqual([type(task) for task in task_queue], [Shared, Root, Root])
 
-    def _get_template_job(self) -> client.V1Job:
-        return client.V1Job(api_version="batch/v1",
-                            kind="Job",
-                            metadata=client.V1ObjectMeta(
-                                name="dummy-job-name",
-                                namespace="dummy-namespace",
-                            ),
-                            spec=client.V1JobSpec(template=client.V1PodTemplateSpec(spec=client.V1PodSpec(
-                                service_account_name="dummy-service-account",
-                                containers=[client.V1Container(
-                                    name="job",
-                                    image="dummy-image",
-                                )],
-                                restart_policy="Never",
-                            ))))
+        # tasks already in the queue are not pushed again
+        master.add_root_task(Root(param=1))
+        master.add_root_task(Root(param=2))
+        master._enqueue_added_root_tasks(task_queue)
+        self.assertEqual(len(task_queue), 4)
+        self.assertEqual(task_queue[-1].param, 2)
+
+
+class TestCreateChildJobObject(unittest.TestCase):
 
     def tearDown(self) -> None:
         super().tearDown()
@@ -77,7 +126,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
         master = Kannon(
             api_instance=None,
             template_job=template_job,
@@ -91,18 +140,18 @@ class TestCreateChildJobObject(unittest.TestCase):
         child_job = master._create_child_job_object(child_job_name, path_to_pkl)
 
         # following should be copied from template_job
-        self.assertEqual(child_job.api_version, template_job.api_version)
-        self.assertEqual(child_job.kind, template_job.kind)
-        self.assertEqual(child_job.metadata.namespace, template_job.metadata.namespace)
-        self.assertEqual(child_job.spec.template.spec.service_account_name, template_job.spec.template.spec.service_account_name)
-        self.assertEqual(child_job.spec.template.spec.containers[0].name, template_job.spec.template.spec.containers[0].name)
-        self.assertEqual(child_job.spec.template.spec.containers[0].image, template_job.spec.template.spec.containers[0].image)
-        self.assertEqual(child_job.spec.template.spec.restart_policy, template_job.spec.template.spec.restart_policy)
+        self.assertEqual(child_job["apiVersion"], template_job.api_version)
+        self.assertEqual(child_job["kind"], template_job.kind)
+        self.assertEqual(child_job["metadata"]["namespace"], template_job.metadata.namespace)
+        self.assertEqual(child_job["spec"]["template"]["spec"]["serviceAccountName"], template_job.spec.template.spec.service_account_name)
+        self.assertEqual(child_job["spec"]["template"]["spec"]["containers"][0]["name"], template_job.spec.template.spec.containers[0].name)
+        self.assertEqual(child_job["spec"]["template"]["spec"]["containers"][0]["image"], template_job.spec.template.spec.containers[0].image)
+        self.assertEqual(child_job["spec"]["template"]["spec"]["restartPolicy"], template_job.spec.template.spec.restart_policy)
         # following should be overwritten
-        self.assertEqual(child_job.spec.template.spec.containers[0].command, ["python", __file__, "--task-pkl-path", f"'{path_to_pkl}'"])
-        self.assertEqual(child_job.metadata.name, child_job_name)
+        self.assertEqual(child_job["spec"]["template"]["spec"]["containers"][0]["command"], ["python", __file__, "--task-pkl-path", f"'{path_to_pkl}'"])
+        self.assertEqual(child_job["metadata"]["name"], child_job_name)
         # envvar TASK_WORKSPACE_DIRECTORY should be inherited
-        child_env = child_job.spec.template.spec.containers[0].env
+        child_env = child_job["spec"]["template"]["spec"]["containers"][0]["env"]
         self.assertEqual(len(child_env), 1)
         self.assertEqual(child_env[0], {"name": "TASK_WORKSPACE_DIRECTORY", "value": "/cache"})
 
@@ -112,7 +161,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
         master = Kannon(
             api_instance=None,
             template_job=template_job,
@@ -125,11 +174,15 @@ class TestCreateChildJobObject(unittest.TestCase):
         child_job_name = "test-job"
         child_job = master._create_child_job_object(child_job_name, path_to_pkl)
 
-        child_env = child_job.spec.template.spec.containers[0].env
+        child_env = child_job["spec"]["template"]["spec"]["containers"][0]["env"]
         self.assertEqual(len(child_env), 3)
         self.assertEqual(child_env[0], {"name": "TASK_WORKSPACE_DIRECTORY", "value": "/cache"})
         self.assertEqual(child_env[1], {"name": "MY_ENV0", "value": "env0"})
         self.assertEqual(child_env[2], {"name": "MY_ENV1", "value": "env1"})
+        # the rendered template should be shared but not modified across child jobs
+        another_child_job = master._create_child_job_object("another-job", path_to_pkl)
+        self.assertEqual(len(another_child_job["spec"]["template"]["spec"]["containers"][0]["env"]), 3)
+        self.assertEqual(child_job["metadata"]["name"], child_job_name)
 
     def test_fail_command_set(self) -> None:
 
@@ -137,7 +190,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
         template_job.spec.template.spec.containers[0].command = ["dummy-command"]
         master = Kannon(
             api_instance=None,
@@ -157,7 +210,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
 
         cases = [None, ["TASK_WORKSPACE_DIRECTORY", "MY_ENV0", "MY_ENV1"]]
         for case in cases:
@@ -178,7 +231,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
         master_pod_name = "dummy-master-pod-name"
         master_pod_uid = "dummy-master-pod-uid"
         master = Kannon(
@@ -195,11 +248,11 @@ class TestCreateChildJobObject(unittest.TestCase):
         child_job_name = "test-job"
         child_job = master._create_child_job_object(child_job_name, path_to_pkl)
 
-        owner_references = child_job.metadata.owner_references
+        owner_references = child_job["metadata"]["ownerReferences"]
         self.assertEqual(len(owner_references), 1)
         owner_reference = owner_references[0]
-        self.assertEqual(owner_reference.name, master_pod_name)
-        self.assertEqual(owner_reference.uid, master_pod_uid)
+        self.assertEqual(owner_reference["name"], master_pod_name)
+        self.assertEqual(owner_reference["uid"], master_pod_uid)
 
     def test_owner_reference_not_set(self) -> None:
 
@@ -207,7 +260,7 @@ class TestCreateChildJobObject(unittest.TestCase):
             pass
 
         path_to_pkl = "path/to/obj"
-        template_job = self._get_template_job()
+        template_job = _get_template_job()
         master = Kannon(
             api_instance=None,
             template_job=template_job,
@@ -222,7 +275,536 @@ class TestCreateChildJobObject(unittest.TestCase):
             child_job = master._create_child_job_object(child_job_name, path_to_pkl)
 
         self.assertEqual(cm.output, ['WARNING:kannon.master:Owner reference is not set because master pod info is not provided.'])
-        self.assertTrue(child_job.metadata.owner_references is None)
+        self.assertTrue("ownerReferences" not in child_job["metadata"])
+
+    def test_default_ttl_seconds_after_finished(self) -> None:
+        cases = [(None, None, DEFAULT_TTL_SECONDS_AFTER_FINISHED), (None, 3600, 3600), ("master-pod", None, None)]
+        for master_pod_name, template_ttl, expected in cases:
+            with self.subTest(master_pod_name=master_pod_name, template_ttl=template_ttl):
+                template_job = _get_template_job()
+                template_job.spec.ttl_seconds_after_finished = template_ttl
+                master = Kannon(
+                    api_instance=None,
+                    template_job=template_job,
+                    job_prefix="",
+                    path_child_script=__file__,  # just pass any existing file as dummy
+                    master_pod_name=master_pod_name,
+                    master_pod_uid="uid" if master_pod_name else None,
+                )
+                child_job = master._create_child_job_object("test-job", "path/to/obj")
+                self.assertEqual(child_job["spec"].get("ttlSecondsAfterFinished"), expected)
+
+    def test_anti_affinity_set(self) -> None:
+        path_to_pkl = "path/to/obj"
+        template_job = _get_template_job()
+        master = Kannon(
+            api_instance=None,
+            template_job=template_job,
+            job_prefix="",
+            path_child_script=__file__,  # just pass any existing file as dummy
+            env_to_inherit=None,
+        )
+        child_job = master._create_child_job_object("test-job", path_to_pkl, anti_affinity_job_name="original-job")
+
+        terms = child_job["spec"]["template"]["spec"]["affinity"]["podAntiAffinity"]["requiredDuringSchedulingIgnoredDuringExecution"]
+        self.assertEqual(len(terms), 1)
+        self.assertEqual(terms[0]["labelSelector"]["matchLabels"], {"job-name": "original-job"})
+        self.assertEqual(terms[0]["topologyKey"], "kubernetes.io/hostname")
+        # template job should not be modified
+        self.assertIsNone(template_job.spec.template.spec.affinity)
+        self.assertNotIn("affinity", master._create_child_job_object("test-job-2", path_to_pkl)["spec"]["template"]["spec"])
+
+    def test_ttl_seconds_after_finished(self) -> None:
+        template_job = _get_template_job()
+        template_job.spec.ttl_seconds_after_finished = 3600
+        cases = [(None, 3600), (60, 60)]
+        for ttl_seconds_after_finished, expected in cases:
+            with self.subTest(ttl_seconds_after_finished=ttl_seconds_after_finished):
+                master = Kannon(
+                    api_instance=None,
+                    template_job=template_job,
+                    job_prefix="",
+                    path_child_script=__file__,  # just pass any existing file as dummy
+                    ttl_seconds_after_finished=ttl_seconds_after_finished,
+                )
+                child_job = master._create_child_job_object("test-job", "path/to/obj")
+                self.assertEqual(child_job["spec"]["ttlSecondsAfterFinished"], expected)
+
+    def test_profile_modes_env(self) -> None:
+        master = Kannon(
+            api_instance=None,
+            template_job=_get_template_job(),
+            job_prefix="",
+            path_child_script=__file__,  # just pass any existing file as dummy
+            profiling={"Example": ["cprofile", "rss"]},
+        )
+        child_job = master._create_child_job_object("test-job", "path/to/obj", profile_modes=["cprofile", "rss"])
+        self.assertEqual(child_job["spec"]["template"]["spec"]["containers"][0]["env"], [{"name": "KANNON_PROFILE_MODES", "value": "cprofile,rss"}])
+
+        with self.assertRaises(ValueError):
+            Kannon(
+                api_instance=None,
+                template_job=_get_template_job(),
+                job_prefix="",
+                path_child_script=__file__,
+                profiling={"Example": ["unknown"]},
+            )
+
+
+class TestChildJobCleanup(unittest.TestCase):
+
+    class Example(TaskOnBullet):
+        pass
+
+    def _get_master(self, api_instance: MagicMock, delete_succeeded_jobs: bool = True) -> Kannon:
+        return _get_master(api_instance, delete_succeeded_jobs=delete_succeeded_jobs)
+
+    def test_cleanup_child_job(self) -> None:
+        task = self.Example()
+        cases = [
+            # (delete_succeeded_jobs, job status, expected result, expected deletion)
+            (True, JobStatus.SUCCEEDED, True, True),
+            (True, JobStatus.FAILED, True, False),
+            (True, JobStatus.RUNNING, False, False),
+            (False, JobStatus.SUCCEEDED, True, False),
+        ]
+        for delete_succeeded_jobs, job_status, expected, expected_deletion in cases:
+            with self.subTest(delete_succeeded_jobs=delete_succeeded_jobs, job_status=job_status):
+                api_instance = MagicMock()
+                master = self._get_master(api_instance, delete_succeeded_jobs=delete_succeeded_jobs)
+                master.task_id_to_job_name[task.make_unique_id()] = "test-job"
+                with patch("kannon.master.get_job_status", return_value=job_status):
+                    self.assertEqual(master._cleanup_child_job(task), expected)
+                self.assertEqual(api_instance.delete_namespaced_job.called, expected_deletion)
+
+    def test_final_status_is_cached(self) -> None:
+        master = self._get_master(MagicMock())
+        with patch("kannon.master.get_job_status", return_value=JobStatus.SUCCEEDED) as mock_get_job_status:
+            master._get_job_status("test-job")
+            master._get_job_status("test-job")
+        mock_get_job_status.assert_called_once()
+
+    def test_job_deleted_by_ttl(self) -> None:
+
+        class Completed(TaskOnBullet):
+
+            def complete(self) -> bool:
+                return True
+
+        class Parent(gokart.TaskOnKart):
+
+            def requires(self) -> Completed:
+                return Completed()
+
+        master = self._get_master(MagicMock())
+        master.task_id_to_job_name[Completed().make_unique_id()] = "deleted-job"
+        with patch("kannon.master.get_job_status", side_effect=ApiException(status=404)):
+            # the job of the completed task is deleted before its final status is observed
+            self.assertTrue(master._is_executable(Parent()))
+            self.assertEqual(master.job_name_to_final_status["deleted-job"], JobStatus.SUCCEEDED)
+            # the job of a running task must not disappear
+            master.task_id_to_job_name[self.Example().make_unique_id()] = "running-job"
+            with self.assertRaises(ApiException):
+                master._check_child_task_status(self.Example())
+
+    def test_cancel_running_child_jobs_on_failure(self) -> None:
+
+        class Example(TaskOnBullet):
+
+            def complete(self) -> bool:
+                return False
+
+        api_instance = MagicMock()
+        master = self._get_master(api_instance)
+        master.task_id_to_job_name = {"a": "running-job", "b": "failed-job"}
+        job_name_to_status = {"running-job": JobStatus.RUNNING, "failed-job": JobStatus.FAILED}
+        master._exec_bullet_task = MagicMock(side_effect=KeyboardInterrupt())  # type:ignore
+
+        with patch("kannon.master.get_job_status", side_effect=lambda _, job_name, __: job_name_to_status[job_name]):
+            with patch("kannon.master.sleep"):
+                with self.assertRaises(KeyboardInterrupt):
+                    master.build(Example())
+        api_instance.delete_namespaced_job.assert_called_once_with(name="running-job", namespace="dummy-namespace", propagation_policy="Background")
+
+
+class TestSpeculativeExecution(unittest.TestCase):
+
+    class Example(TaskOnBullet):
+        pass
+
+    def _get_master(self, api_instance: MagicMock) -> Kannon:
+        return _get_master(api_instance, speculative_percentile=50, speculative_min_samples=2)
+
+    def test_invalid_percentile(self) -> None:
+        for case in [0, 101]:
+            with self.subTest(case=case):
+                with self.assertRaises(ValueError):
+                    Kannon(
+                        api_instance=None,
+                        template_job=client.V1Job(metadata=client.V1ObjectMeta()),
+                        job_prefix="",
+                        path_child_script=__file__,  # just pass any existing file as dummy
+                        speculative_percentile=case,
+                    )
+
+    def test_speculative_jobs_count_for_max_child_jobs(self) -> None:
+        master = Kannon(
+            api_instance=None,
+            template_job=client.V1Job(metadata=client.V1ObjectMeta()),
+            job_prefix="",
+            path_child_script=__file__,  # just pass any existing file as dummy
+            max_child_jobs=2,
+        )
+        self.assertFalse(master._reach_max_child_jobs({"0"}))
+        # a running task with its duplicate takes both of the slots
+        master.task_id_to_speculative_job_name["0"] = "speculative-job"
+        self.assertTrue(master._reach_max_child_jobs({"0"}))
+
+    def test_launch_speculative_job(self) -> None:
+        api_instance = MagicMock()
+        master = self._get_master(api_instance)
+        task = self.Example()
+        task_id = task.make_unique_id()
+        master.task_id_to_job_name[task_id] = "original-job"
+        master.task_family_to_child_runtimes[task.get_task_family()] = [1.0, 2.0, 3.0]
+
+        # not straggling yet
+        with patch("kannon.master.time", return_value=100.0):
+            master.task_id_to_launched_at[task_id] = 99.0
+            master._launch_speculative_job_if_straggling(task, None)
+        api_instance.create_namespaced_job.assert_not_called()
+
+        # straggling
+        with patch("kannon.master.time", return_value=110.0):
+            master._launch_speculative_job_if_straggling(task, None)
+        api_instance.create_namespaced_job.assert_called_once()
+        self.assertIn(task_id, master.task_id_to_speculative_job_name)
+
+        # duplicate is launched only once
+        with patch("kannon.master.time", return_value=120.0):
+            master._launch_speculative_job_if_straggling(task, None)
+        api_instance.create_namespaced_job.assert_called_once()
+
+    def test_multiple_file_outputs_are_not_speculated(self) -> None:
+
+        class LargeDataFrame(TaskOnBullet):
+
+            def output(self) -> gokart.target.TargetOnKart:
+                return self.make_large_data_frame_target()
+
+        api_instance = MagicMock()
+        master = self._get_master(api_instance)
+        task = LargeDataFrame()
+        master.task_id_to_job_name[task.make_unique_id()] = "original-job"
+        master.task_id_to_launched_at[task.make_unique_id()] = 0.0
+        master.task_family_to_child_runtimes[task.get_task_family()] = [1.0, 2.0, 3.0]
+
+        with patch("kannon.master.time", return_value=100.0):
+            master._launch_speculative_job_if_straggling(task, None)
+        api_instance.create_namespaced_job.assert_not_called()
+
+    def test_runtime_series(self) -> None:
+        master = self._get_master(MagicMock())
+        master.inline_runtime_threshold_sec = 10.0
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            task = self.Example(workspace_directory=workspace_dir)
+            master.task_id_to_launched_at[task.make_unique_id()] = 100.0
+            make_target(gen_report_path(master._gen_pkl_path(task))).dump(dict(started_at=130.0, finished_at=132.0, peak_rss=0))
+            with patch("kannon.master.time", return_value=140.0):
+                master._record_runtime(task)
+            with patch("kannon.master.time", side_effect=[200.0, 201.0]), patch.object(master, "_exec_gokart_task"):
+                master._exec_master_task(self.Example(workspace_directory=workspace_dir, rerun=True))
+
+        # inline runtimes are not the baseline of stragglers, and placement is based on wall times without the startup of child jobs
+        self.assertEqual(master.task_family_to_child_runtimes[task.get_task_family()], [40.0])
+        self.assertEqual(master.task_family_to_wall_times[task.get_task_family()], [2.0, 1.0])
+        self.assertEqual(master._decide_placement(task), "master")
+
+    def test_wait_for_report(self) -> None:
+        master = self._get_master(MagicMock())
+        master.inline_runtime_threshold_sec = 10.0
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            task = self.Example(workspace_directory=workspace_dir)
+            master.task_id_to_job_name[task.make_unique_id()] = "test-job"
+            master.task_id_to_launched_at[task.make_unique_id()] = 100.0
+            # the output is dumped, but the report is not written yet
+            with patch("kannon.master.get_job_status", return_value=JobStatus.RUNNING):
+                self.assertFalse(master._record_runtime(task))
+            self.assertNotIn(task.get_task_family(), master.task_family_to_child_runtimes)
+
+            make_target(gen_report_path(master._gen_pkl_path(task))).dump(dict(started_at=130.0, finished_at=132.0, peak_rss=0))
+            with patch("kannon.master.time", return_value=140.0):
+                self.assertTrue(master._record_runtime(task))
+        self.assertEqual(master.task_family_to_child_runtimes[task.get_task_family()], [40.0])
+        self.assertEqual(master.task_family_to_wall_times[task.get_task_family()], [2.0])
+
+    def test_not_enough_samples(self) -> None:
+        api_instance = MagicMock()
+        master = self._get_master(api_instance)
+        task = self.Example()
+        master.task_id_to_job_name[task.make_unique_id()] = "original-job"
+        master.task_id_to_launched_at[task.make_unique_id()] = 0.0
+        master.task_family_to_child_runtimes[task.get_task_family()] = [1.0]
+
+        master._launch_speculative_job_if_straggling(task, None)
+        api_instance.create_namespaced_job.assert_not_called()
+
+    def test_resolve_speculative_jobs(self) -> None:
+        task = self.Example()
+        task_id = task.make_unique_id()
+        cases = [
+            # (original status, speculative status, expected result, expected winner, expected deleted job)
+            # the result is False until pods of the deleted job are gone
+            (JobStatus.RUNNING, JobStatus.SUCCEEDED, False, "speculative-job", "original-job"),
+            (JobStatus.SUCCEEDED, JobStatus.RUNNING, False, "original-job", "speculative-job"),
+            (JobStatus.SUCCEEDED, JobStatus.FAILED, True, "original-job", None),
+            (JobStatus.RUNNING, JobStatus.RUNNING, False, "original-job", None),
+        ]
+        for original_status, speculative_status, expected, expected_winner, expected_deleted in cases:
+            with self.subTest(original_status=original_status, speculative_status=speculative_status):
+                api_instance = MagicMock()
+                master = self._get_master(api_instance)
+                master.task_id_to_job_name[task_id] = "original-job"
+                master.task_id_to_speculative_job_name[task_id] = "speculative-job"
+                with patch("kannon.master.get_job_status", side_effect=[original_status, speculative_status]):
+                    self.assertEqual(master._resolve_speculative_jobs(task), expected)
+                self.assertEqual(master.task_id_to_job_name[task_id], expected_winner)
+                if expected_deleted:
+                    api_instance.delete_namespaced_job.assert_called_once_with(name=expected_deleted,
+                                                                               namespace="dummy-namespace",
+                                                                               propagation_policy="Foreground")
+                    self.assertEqual(master.task_id_to_terminating_job_name[task_id], expected_deleted)
+                    # the deleted job is removed after its pods
+                    api_instance.read_namespaced_job.side_effect = ApiException(status=404)
+                    self.assertTrue(master._resolve_speculative_jobs(task))
+                    self.assertNotIn(task_id, master.task_id_to_terminating_job_name)
+                else:
+                    api_instance.delete_namespaced_job.assert_not_called()
+
+    def test_check_child_task_status(self) -> None:
+        master = self._get_master(MagicMock())
+        task = self.Example()
+        master.task_id_to_job_name[task.make_unique_id()] = "original-job"
+        master.task_id_to_speculative_job_name[task.make_unique_id()] = "speculative-job"
+        # one of the attempts is still running
+        with patch("kannon.master.get_job_status", side_effect=[JobStatus.FAILED, JobStatus.RUNNING]):
+            master._check_child_task_status(task)
+        with patch("kannon.master.get_job_status", side_effect=[JobStatus.FAILED, JobStatus.FAILED]):
+            with self.assertRaises(RuntimeError):
+                master._check_child_task_status(task)
+
+
+class TestStuckChildJob(unittest.TestCase):
+
+    class Example(TaskOnBullet):
+        pass
+
+    def _get_master(self, api_instance: MagicMock, stuck_child_policy: Literal["fail", "reschedule"]) -> Kannon:
+        return _get_master(api_instance,
+                           core_api_instance=MagicMock(),
+                           stuck_child_timeout_sec=60,
+                           stuck_child_policy=stuck_child_policy,
+                           max_child_reschedules=1)
+
+    def test_fail(self) -> None:
+        api_instance = MagicMock()
+        master = self._get_master(api_instance, "fail")
+        task = self.Example()
+        master.task_id_to_job_name[task.make_unique_id()] = "test-job"
+
+        with patch("kannon.master.get_stuck_pod_reason", return_value="ImagePullBackOff"):
+            with patch("kannon.master.time", return_value=100.0):
+                master._check_stuck_child_job(task, "test-job")
+            api_instance.delete_namespaced_job.assert_not_called()
+            with patch("kannon.master.time", return_value=170.0):
+                with self.assertRaises(RuntimeError):
+                    master._check_stuck_child_job(task, "test-job")
+        api_instance.delete_namespaced_job.assert_called_once()
+
+    def test_recover(self) -> None:
+        master = self._get_master(MagicMock(), "fail")
+        task = self.Example()
+        with patch("kannon.master.get_stuck_pod_reason", side_effect=["Unschedulable", None, "Unschedulable"]):
+            with patch("kannon.master.time", return_value=100.0):
+                master._check_stuck_child_job(task, "test-job")
+                master._check_stuck_child_job(task, "test-job")
+            # stuck duration is reset once pods have recovered
+            with patch("kannon.master.time", return_value=170.0):
+                master._check_stuck_child_job(task, "test-job")
+        self.assertEqual(master.job_name_to_stuck_since["test-job"], 170.0)
+
+    def test_reschedule(self) -> None:
+        api_instance = MagicMock()
+        master = self._get_master(api_instance, "reschedule")
+        task = self.Example()
+        master.task_id_to_job_name[task.make_unique_id()] = "test-job"
+
+        with patch("kannon.master.get_stuck_pod_reason", return_value="Unschedulable"):
+            with patch("kannon.master.time", return_value=100.0):
+                master._check_stuck_child_job(task, "test-job")
+            with patch("kannon.master.time", return_value=170.0):
+                master._check_stuck_child_job(task, "test-job")
+            rescheduled_job_name = master.task_id_to_job_name[task.make_unique_id()]
+            self.assertNotEqual(rescheduled_job_name, "test-job")
+            self.assertEqual(master.task_id_to_launched_at[task.make_unique_id()], 170.0)
+            api_instance.create_namespaced_job.assert_called_once()
+            # reschedule only max_child_reschedules times
+            with patch("kannon.master.time", return_value=200.0):
+                master._check_stuck_child_job(task, rescheduled_job_name)
+            with patch("kannon.master.time", return_value=300.0):
+                with self.assertRaises(RuntimeError):
+                    master._check_stuck_child_job(task, rescheduled_job_name)
+
+    def test_list_pods_once_per_interval(self) -> None:
+        master = self._get_master(MagicMock(), "fail")
+        child_job = master._create_child_job_object("job-0", "path/to/obj")
+        labels = {"job-name": "job-0", **child_job["spec"]["template"]["metadata"]["labels"]}
+        pod = client.V1Pod(metadata=client.V1ObjectMeta(name="pod-0", labels=labels), status=client.V1PodStatus(phase="Running"))
+        master.core_api_instance.list_namespaced_pod.return_value = client.V1PodList(items=[pod])
+
+        # pods of all child jobs of the build are listed by a single call
+        with patch("kannon.master.time", return_value=100.0):
+            self.assertEqual(master._get_child_pods("job-0"), [pod])
+            self.assertEqual(master._get_child_pods("job-1"), [])
+        master.core_api_instance.list_namespaced_pod.assert_called_once_with(namespace="dummy-namespace", label_selector=f"kannon-build-id={master.build_id}")
+        with patch("kannon.master.time", return_value=110.0):
+            master._get_child_pods("job-0")
+        self.assertEqual(master.core_api_instance.list_namespaced_pod.call_count, 2)
+        # pods are listed again if the last list is older than required
+        with patch("kannon.master.time", return_value=115.0):
+            master._get_child_pods("job-0", listed_after=112.0)
+            master._get_child_pods("job-0", listed_after=110.0)
+        self.assertEqual(master.core_api_instance.list_namespaced_pod.call_count, 3)
+
+
+class TestNodeLocality(unittest.TestCase):
+
+    class Source(TaskOnBullet):
+        param = luigi.IntParameter()
+
+    class Example(TaskOnBullet):
+        parents = gokart.ListTaskInstanceParameter()
+
+        def requires(self) -> list[gokart.TaskOnKart]:
+            return self.parents
+
+    def _get_master(self, api_instance: MagicMock) -> Kannon:
+        return _get_master(api_instance, node_local_cache_dir="/var/cache/kannon")
+
+    def test_create_child_job_object(self) -> None:
+        master = self._get_master(MagicMock())
+        child_job = master._create_child_job_object("test-job", "path/to/obj", preferred_node_name="node-0")
+
+        pod_spec = child_job["spec"]["template"]["spec"]
+        self.assertEqual(pod_spec["volumes"], [{"name": "kannon-node-local-cache", "hostPath": {"path": "/var/cache/kannon", "type": "DirectoryOrCreate"}}])
+        self.assertEqual(pod_spec["containers"][0]["volumeMounts"], [{"name": "kannon-node-local-cache", "mountPath": "/var/cache/kannon"}])
+        self.assertEqual(pod_spec["containers"][0]["env"], [
+            {
+                "name": "KANNON_NODE_NAME",
+                "valueFrom": {
+                    "fieldRef": {
+                        "fieldPath": "spec.nodeName"
+                    }
+                }
+            },
+            {
+                "name": "KANNON_NODE_LOCAL_CACHE_DIR",
+                "value": "/var/cache/kannon"
+            },
+            {
+                "name": "KANNON_NODE_LOCAL_CACHE_MAX_BYTES",
+                "value": str(10 * 1024**3)
+            },
+        ])
+        terms = pod_spec["affinity"]["nodeAffinity"]["preferredDuringSchedulingIgnoredDuringExecution"]
+        self.assertEqual(terms, [{"weight": 100, "preference": {"matchFields": [{"key": "metadata.name", "operator": "In", "values": ["node-0"]}]}}])
+
+    def test_get_preferred_node_name(self) -> None:
+        master = self._get_master(MagicMock())
+        sources = [self.Source(param=i) for i in range(3)]
+        task = self.Example(parents=sources)
+        self.assertIsNone(master._get_preferred_node_name(task))
+
+        master.task_id_to_node_locality[sources[0].make_unique_id()] = ("node-0", 100)
+        master.task_id_to_node_locality[sources[1].make_unique_id()] = ("node-1", 1000)
+        self.assertEqual(master._get_preferred_node_name(task), "node-1")
+
+    def test_record_node_locality(self) -> None:
+        master = self._get_master(MagicMock())
+        with tempfile.TemporaryDirectory() as workspace_dir:
+            task = self.Source(param=0, workspace_directory=workspace_dir)
+            master.task_id_to_job_name[task.make_unique_id()] = "test-job"
+            # wait for the report while the job is running
+            with patch("kannon.master.get_job_status", return_value=JobStatus.RUNNING):
+                self.assertFalse(master._record_node_locality(task))
+
+            make_target(gen_report_path(master._gen_pkl_path(task))).dump(dict(node_name="node-0", output_size=100))
+            self.assertTrue(master._record_node_locality(task))
+            self.assertEqual(master.task_id_to_node_locality[task.make_unique_id()], ("node-0", 100))
+
+    def test_executor_not_supported(self) -> None:
+        with self.assertRaises(ValueError):
+            Kannon(api_instance=None, template_job=None, job_prefix="", executor=MagicMock(), node_local_cache_dir="/var/cache/kannon")
+
+
+class TestRunningSummary(unittest.TestCase):
+
+    def test_log_running_summary(self) -> None:
+        master = Kannon(
+            api_instance=MagicMock(),
+            template_job=client.V1Job(metadata=client.V1ObjectMeta(namespace="dummy-namespace")),
+            job_prefix="dummy",
+            path_child_script=__file__,  # just pass any existing file as dummy
+            core_api_instance=MagicMock(),
+            stream_child_logs=True,
+            progress_log_interval_sec=60,
+        )
+        master.log_streamer = ChildLogStreamer(MagicMock(), "dummy-namespace", MagicMock(), io.StringIO())
+        master.log_streamer.job_name_to_task_info.update({"job-0": "Example_0", "job-1": "Example_1"})
+        master.log_streamer.job_name_to_progress["job-0"] = "3/10 (30%)"
+        master.task_id_to_job_name.update({"0": "job-0", "1": "job-1"})
+        master.running_summary_logged_at = 100.0
+
+        # summary is logged at most once per progress_log_interval_sec
+        with self.assertLogs() as cm:
+            with patch("kannon.master.time", return_value=130.0):
+                master._log_running_summary(["0", "1"])
+            with patch("kannon.master.time", return_value=160.0):
+                master._log_running_summary(["0", "1"])
+            with patch("kannon.master.time", return_value=200.0):
+                master._log_running_summary(["0", "1"])
+        self.assertEqual(cm.output, ["INFO:kannon.master:2 tasks are running on child jobs. Progress: Example_0: 3/10 (30%)"])
+        self.assertEqual(master.running_summary_logged_at, 160.0)
+
+    def test_stop_log_stream(self) -> None:
+        master = Kannon(
+            api_instance=MagicMock(),
+            template_job=client.V1Job(metadata=client.V1ObjectMeta(namespace="dummy-namespace")),
+            job_prefix="dummy",
+            path_child_script=__file__,  # just pass any existing file as dummy
+            core_api_instance=MagicMock(),
+            stream_child_logs=True,
+        )
+        master.log_streamer = MagicMock()
+        # streams are stopped once jobs are observed as finished or deleted
+        with patch("kannon.master.get_job_status", side_effect=[JobStatus.RUNNING, JobStatus.FAILED]):
+            master._get_job_status("job-0")
+            master.log_streamer.stop.assert_not_called()
+            master._get_job_status("job-0")
+            master.log_streamer.stop.assert_called_once_with("job-0")
+        with patch("kannon.master.delete_job"):
+            master._delete_job("job-1")
+        master.log_streamer.stop.assert_called_with("job-1")
+
+    def test_core_api_required(self) -> None:
+        with self.assertRaises(ValueError):
+            Kannon(
+                api_instance=MagicMock(),
+                template_job=client.V1Job(metadata=client.V1ObjectMeta(namespace="dummy-namespace")),
+                job_prefix="dummy",
+                path_child_script=__file__,  # just pass any existing file as dummy
+                stream_child_logs=True,
+            )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import unittest
+
+import gokart
+from gokart.target import make_target
+
+from kannon.node_cache import evict_node_local_cache, gen_node_local_cache_path, get_cached_output_size, use_node_local_cache
+
+
+class Source(gokart.TaskOnKart):
+
+    def run(self) -> None:
+        self.dump([1, 2, 3])
+
+
+class Sum(gokart.TaskOnKart):
+    parent = gokart.TaskInstanceParameter()
+
+    def requires(self) -> dict[str, gokart.TaskOnKart]:
+        return dict(parent=self.parent)
+
+    def run(self) -> None:
+        self.dump(sum(self.load("parent")))
+
+
+class TestNodeLocalCache(unittest.TestCase):
+
+    def test_gen_node_local_cache_path(self) -> None:
+        self.assertEqual(gen_node_local_cache_path("/cache", "gs://bucket/a.pkl"), "/cache/gs/bucket/a.pkl")
+        self.assertEqual(gen_node_local_cache_path("/cache", "/workspace/a.pkl"), "/cache/workspace/a.pkl")
+
+    def test_write_through_and_read(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir, tempfile.TemporaryDirectory() as cache_dir:
+            source = Source(workspace_directory=workspace_dir)
+            use_node_local_cache(source, cache_dir)
+            gokart.build(source, return_value=False)
+            # outputs are written to both the workspace and the cache
+            cache_path = gen_node_local_cache_path(cache_dir, source.output().path())
+            self.assertEqual(make_target(cache_path).load(), [1, 2, 3])
+            self.assertEqual(get_cached_output_size(source, cache_dir), os.path.getsize(cache_path))
+
+            # overwrite the cache to check that inputs are read from the cache
+            make_target(cache_path).dump([10, 20])
+            task = Sum(parent=Source(workspace_directory=workspace_dir), workspace_directory=workspace_dir)
+            use_node_local_cache(task, cache_dir)
+            gokart.build(task, return_value=False)
+            self.assertEqual(make_target(task.output().path()).load(), 30)
+
+    def test_stale_cache_is_not_used(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir, tempfile.TemporaryDirectory() as cache_dir:
+            source = Source(workspace_directory=workspace_dir)
+            cache_path = gen_node_local_cache_path(cache_dir, source.output().path())
+            make_target(cache_path).dump([10, 20])
+            os.utime(cache_path, (0, 0))
+            gokart.build(source, return_value=False)
+
+            task = Sum(parent=Source(workspace_directory=workspace_dir), workspace_directory=workspace_dir)
+            use_node_local_cache(task, cache_dir)
+            gokart.build(task, return_value=False)
+            self.assertEqual(make_target(task.output().path()).load(), 6)
+
+    def test_evict_least_recently_used(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            paths = [os.path.join(cache_dir, "workspace", f"{i}.pkl") for i in range(3)]
+            os.makedirs(os.path.dirname(paths[0]))
+            for i, path in enumerate(paths):
+                with open(path, "wb") as f:
+                    f.write(b"x" * 100)
+                os.utime(path, (i, i))
+            # the oldest file has been read recently
+            os.utime(paths[0], (10, 0))
+
+            evict_node_local_cache(cache_dir, max_bytes=250)
+            self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+    def test_evict_on_write(self) -> None:
+        with tempfile.TemporaryDirectory() as workspace_dir, tempfile.TemporaryDirectory() as cache_dir:
+            old_cache_path = os.path.join(cache_dir, "old.pkl")
+            with open(old_cache_path, "wb") as f:
+                f.write(b"x" * 1000)
+            os.utime(old_cache_path, (0, 0))
+
+            source = Source(workspace_directory=workspace_dir)
+            use_node_local_cache(source, cache_dir, max_bytes=1000)
+            gokart.build(source, return_value=False)
+            self.assertFalse(os.path.exists(old_cache_path))
+            self.assertTrue(os.path.exists(gen_node_local_cache_path(cache_dir, source.output().path())))
+
+
+if __name__ == '__main__':
+    unittest.main()
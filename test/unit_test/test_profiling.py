@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import unittest
+
+from kannon.profiling import _get_rss, gen_profile_path, load_cprofile_stats, measure_peak_rss, profile_execution, validate_profile_modes
+
+
+def _work() -> list[int]:
+    return [i**2 for i in range(10000)]
+
+
+class TestProfileExecution(unittest.TestCase):
+
+    def test_all_modes(self) -> None:
+        with profile_execution(["cprofile", "tracemalloc", "rss"]) as profile:
+            _work()
+
+        self.assertEqual(profile["profile_modes"], ["cprofile", "tracemalloc", "rss"])
+        function_names = [func[2] for func in load_cprofile_stats(profile).stats]  # type: ignore
+        self.assertIn("_work", function_names)
+        self.assertGreater(profile["tracemalloc"]["peak"], 0)
+        self.assertLessEqual(len(profile["tracemalloc"]["top_allocations"]), 50)
+        self.assertGreaterEqual(len(profile["rss"]), 1)
+
+    def test_single_mode(self) -> None:
+        with profile_execution(["rss"]) as profile:
+            _work()
+        self.assertNotIn("cprofile", profile)
+        self.assertNotIn("tracemalloc", profile)
+        self.assertIn("rss", profile)
+
+    @unittest.skipIf(_get_rss() is None, "RSS is available only on Linux")
+    def test_measure_peak_rss(self) -> None:
+        rss_before = _get_rss()
+        assert rss_before is not None
+        with measure_peak_rss() as memory:
+            buffer = bytearray(64 * 1024 * 1024)
+        del buffer
+        # the buffer which is alive until the end of the context is counted
+        self.assertGreaterEqual(memory["peak_rss"], rss_before + 60 * 1024 * 1024)
+
+        # peak is measured only within the context, unlike ru_maxrss
+        with measure_peak_rss() as memory:
+            pass
+        self.assertLess(memory["peak_rss"], rss_before + 60 * 1024 * 1024)
+
+    def test_unknown_mode(self) -> None:
+        with self.assertRaises(ValueError):
+            validate_profile_modes(["cprofile", "line_profiler"])
+
+    def test_gen_profile_path(self) -> None:
+        self.assertEqual(gen_profile_path("workspace/kannon/task_obj_abc.pkl"), "workspace/kannon/task_obj_abc_profile.pkl")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from kannon.stats import TaskStatsStore
+
+
+class TestTaskStatsStore(unittest.TestCase):
+
+    def test_record_and_flush(self) -> None:
+        with tempfile.TemporaryDirectory() as stats_dir:
+            store = TaskStatsStore(stats_dir)
+            store.record("Example", wall_time=1.0, peak_rss=100.0)
+            store.record("Example", wall_time=3.0)
+            self.assertEqual(store.get_samples("Example", "wall_time"), [1.0, 3.0])
+            store.flush()
+
+            # stats are kept across stores
+            loaded_store = TaskStatsStore(stats_dir)
+            self.assertEqual(loaded_store.get_samples("Example", "wall_time"), [1.0, 3.0])
+            self.assertEqual(loaded_store.get_samples("Example", "peak_rss"), [100.0])
+            self.assertEqual(loaded_store.get_samples("Unknown", "wall_time"), [])
+
+    def test_get_aggregate(self) -> None:
+        with tempfile.TemporaryDirectory() as stats_dir:
+            store = TaskStatsStore(stats_dir)
+            self.assertIsNone(store.get_aggregate("Example", "wall_time"))
+            for wall_time in range(1, 11):
+                store.record("Example", wall_time=float(wall_time))
+            self.assertEqual(store.get_aggregate("Example", "wall_time"), dict(count=10, mean=5.5, p50=5.0, p90=9.0, max=10.0))
+
+    def test_rolling_window(self) -> None:
+        with tempfile.TemporaryDirectory() as stats_dir:
+            store = TaskStatsStore(stats_dir, window_size=3)
+            for wall_time in range(5):
+                store.record("Example", wall_time=float(wall_time))
+            self.assertEqual(store.get_samples("Example", "wall_time"), [2.0, 3.0, 4.0])
+
+    def test_unknown_metric(self) -> None:
+        with tempfile.TemporaryDirectory() as stats_dir:
+            store = TaskStatsStore(stats_dir)
+            with self.assertRaises(ValueError):
+                store.record("Example", unknown=1.0)
+
+    def test_record_concurrently(self) -> None:
+        with tempfile.TemporaryDirectory() as stats_dir:
+            store = TaskStatsStore(stats_dir)
+            # the first records of a family on multiple threads must not load it twice
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda i: store.record("Example", wall_time=float(i)), range(64)))
+            self.assertEqual(len(store.get_samples("Example", "wall_time")), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()